@@ -19,12 +19,20 @@ from cryptography.hazmat.primitives.serialization import (Encoding,
 from PIL import Image, ImageOps
 
 import windows
+from chat_log import unpack
 from crypto_functions import get_key_pair, open_package, send_package
 from filebrowser import FileBrowser
 from git_functions import auto_update
-from server import Server, SlideShow
+from image_cache import ImageCache
+from server import Server, SlideShow, read_listing_page
 from server_browser import ServerBrowser
+from slides import SlideBuffer
 from solitaire import MyGame, arcade
+from thumbnails import unpack_thumbnails
+
+CACHE_FOLDER = os.path.expanduser('~/.cache/teaseai')
+CACHE_SIZE = 512 * 1024 * 1024
+
 
 class Client:
     """Client object for communication with server."""
@@ -36,8 +44,9 @@ class Client:
             """Initialize the session."""
             self.srv_folder = 'Not Connected.'
             self.online_users = []
-            self.browser_folders = ['None']
-            self.browser_files = ['None']
+            self.browser_pages: SimpleQueue[dict] = SimpleQueue()
+            self.thumbnails: dict[str, bytes] = {}
+            self.history_start: int | None = None
             self.srv_key = key
 
     def __init__(self) -> None:
@@ -58,6 +67,8 @@ class Client:
         self.queue = SimpleQueue()
         self.status = 'Not connected to any server.'
         self.media = None
+        self.slides = SlideBuffer(ImageCache(CACHE_FOLDER, CACHE_SIZE),
+                                  self._pad_image)
         self.server_status = 'No server running.'
         self.window = windows.main_window(self)
         self.media_size = self.window['IMAGE'].get_size()
@@ -79,6 +90,9 @@ class Client:
                 for user in self.session.online_users:
                     self.window['ONLINE_USERS'].update('%s\n' % user,
                                                        append=True)
+            slide = self.slides.due()
+            if slide is not None:
+                self.media = slide
             if self.media is not None:
                 self.window['IMAGE'].update(self.media)
             self.window['SRV_FOLDER'].update(self.session.srv_folder)
@@ -157,24 +171,64 @@ class Client:
             if chunk != 'END':
                 self.session.online_users.append(chunk)
 
-    def _folders_and_files(self, msg: str) -> None:
+    def _folders_and_files(self, msg: bytes) -> None:
         """
-        Passes retrieved folder and file information to the server browser\
-            object.
+        Passes a page of folder and file information retrieved from the
+        server to the server browser object.
 
-        :param msg: A message packet from the server containing the folder and\
-            file information.
-        :type msg: string
+        :param msg: A message packet from the server containing a page of
+            the folder listing as JSON.
+        :type msg: bytes
+        """
+        page = read_listing_page(msg)
+        if page is not None:
+            self.session.browser_pages.put(page)
+
+    def _add_thumbnails(self, msg: bytes) -> None:
+        """
+        Stores a page of thumbnails retrieved from the server for the server
+        browser's preview pane, converted to PNG so it can be displayed.
+
+        :param msg: A message packet from the server containing a page of
+            thumbnails as JSON.
+        :type msg: bytes
+        """
+        for image, data in (unpack_thumbnails(msg) or {}).items():
+            try:
+                with Image.open(BytesIO(data)) as img, BytesIO() as bio:
+                    img.save(bio, format='PNG')
+                    self.session.thumbnails[image] = bio.getvalue()
+            except OSError:
+                continue
+
+    def _show_history(self, msg: bytes) -> None:
+        """
+        Prints chat history sent by the server, either the lines replayed on
+        joining or an older page requested with `request_history()`.
+
+        :param msg: A message packet from the server containing compressed
+            chat lines, oldest first.
+        :type msg: bytes
         """
-        browse_data = msg.split(':')
-        try:
-            self.session.browser_folders = browse_data[1].split(',')
-        except IndexError:
-            pass
-        try:
-            self.session.browser_files = browse_data[3].split(',')
-        except IndexError:
-            pass
+        lines = unpack(msg)
+        if lines is None:
+            return
+        if not lines:
+            if self.session.history_start is not None:
+                sG.cprint('No older chat history.')
+            return
+        if self.session.history_start is not None:
+            sG.cprint('--- Earlier chat ---')
+        self.session.history_start = lines[0][0]
+        for _, _, text in lines:
+            sG.cprint(text)
+
+    def request_history(self) -> None:
+        """Requests the page of chat history before the oldest line shown."""
+        if self.session.history_start is None:
+            sG.cprint('No older chat history.')
+        else:
+            self.send_message(str(self.session.history_start), 'HIS')
 
     def _receive_messages(self) -> None:
         """Receive messages from the server."""
@@ -191,16 +245,25 @@ class Client:
                 elif msg_type == 'SES':
                     self._set_session_vars(msg.decode())
                     continue
+                elif msg_type == 'HIS':
+                    self._show_history(msg)
+                    continue
                 elif msg_type == 'FOL':
-                    self._folders_and_files(msg.decode())
+                    self._folders_and_files(msg)
+                    continue
+                elif msg_type == 'THB':
+                    self._add_thumbnails(msg)
                     continue
                 elif msg_type == 'IMG':
-                    img = Image.open(BytesIO(msg))
-                    img = ImageOps.pad(img, self.media_size)
-                    with BytesIO() as bio:
-                        img.save(bio, format="PNG")
-                        del img
-                    self.media = bio.getvalue()
+                    self.media = self._pad_image(msg)
+                    continue
+                elif msg_type == 'SLD':
+                    key = self.slides.announce(msg.decode())
+                    if key is not None:
+                        self.send_message(key, 'GET')
+                    continue
+                elif msg_type == 'BLB':
+                    self.slides.receive(msg)
                     continue
                 elif msg_type == 'ERR':
                     sG.PopupError(msg.decode())
@@ -209,6 +272,22 @@ class Client:
             finally:
                 t.sleep(0.1)
 
+    def _pad_image(self, data: bytes) -> bytes:
+        """
+        Pads an image received from the server to the media pane.
+
+        :param data: The encoded image.
+        :type data: bytes
+        :return: The padded image as PNG.
+        :rtype: bytes
+        """
+        img = Image.open(BytesIO(data))
+        img = ImageOps.pad(img, self.media_size)
+        with BytesIO() as bio:
+            img.save(bio, format="PNG")
+            del img
+            return bio.getvalue()
+
     def _request_file(self, filename: str, size: tuple[int, int]):
         """
         Request a file from the server.  Takes a path to file on the server
@@ -229,8 +308,8 @@ class Client:
 
         :param msg: Message to send.
         :type msg: string
-        :param msg_type: The type of transmission, one of MSG, IMG, SES, FOL\
-            or LOG
+        :param msg_type: The type of transmission, one of MSG, IMG, THB, SES,\
+            FOL, HIS or LOG
         :type msg_type: `str`
         """
         send_package(self.session.srv_key, self.private_key, msg, msg_type,
@@ -287,7 +366,10 @@ if __name__ == '__main__':
         elif event == 'SRV_FORWARD':
             slideshow.next()
         elif event == 'Submit':
-            if client.connected is True:
+            if client.connected is True and \
+                    client.window['INPUT'].get() == '/history':
+                client.request_history()
+            elif client.connected is True:
                 client.send_message(client.window['INPUT'].get(), 'MSG')
             else:
                 sG.cprint('Error: Not connected to server')
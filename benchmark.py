@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Microbenchmarks for the script engine and database"""
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import timeit
+
+from migrations import DB, migrate
+from profiler import find_scripts
+from script_parser import RANDINT, VAR, VOCAB, parse_function, read_script, \
+    tokenize
+
+HOT_QUERIES = (
+    ('option', 'SELECT setting FROM options WHERE name = ?', ('port',)),
+    ('login salt', 'SELECT salt FROM users WHERE username = ?', ('user',)),
+    ('login', 'SELECT username FROM users WHERE username = ? AND '
+     'password = ?', ('user', 'key')),
+    ('synonym parents', 'SELECT ParentSynID FROM synonyms WHERE SynID = ?',
+     (1,)),
+    ('synonym children', 'SELECT SynID FROM synonyms WHERE ParentSynID = ?',
+     (1,)),
+    ('vocab word', 'SELECT SynID FROM vocab WHERE word = ?', ('cock',)),
+    ('synonym cluster', 'SELECT word FROM clusters AS c JOIN clusters AS k '
+     'ON k.ClusterID = c.ClusterID JOIN vocab AS v ON v.SynID = k.SynID '
+     'WHERE c.SynID = ?', (1,)),
+    ('script', 'SELECT info FROM scripts WHERE path = ?', ('x',)),
+    ('user state', 'SELECT key, value FROM user_state WHERE username = ?',
+     ('user',)),
+    ('chat page', 'SELECT id, time, line FROM chat_log WHERE id < ? '
+     'ORDER BY id DESC LIMIT ?', (100, 50)),
+)
+RX_PASSES = (
+    (VOCAB, re.compile(r'_.?\w*\s?\w*.?_')),
+    (VAR, re.compile(r'var\(\w+_*\w*\)')),
+    (RANDINT, re.compile(r'randint\(\d+, \d+\)')),
+)
+
+
+def three_pass_tokenize(text: str) -> tuple:
+    """
+    The previous tokenizer, kept as the baseline: one regex pass per token
+    kind, re-splitting the literal segments left by the earlier passes.
+
+    :param text: The text to split.
+    :type text: str
+    :return: The template.
+    :rtype: tuple
+    """
+    segments: list = [text]
+    for kind, regex in RX_PASSES:
+        split: list = []
+        for segment in segments:
+            if not isinstance(segment, str):
+                split.append(segment)
+                continue
+            position = 0
+            for match in regex.finditer(segment):
+                split.append(segment[position:match.start()])
+                hit = match.group()
+                if kind == VOCAB:
+                    split.append((VOCAB, hit.strip('_')))
+                else:
+                    args = parse_function(hit)[1]
+                    split.append((VAR, args[0]) if kind == VAR else
+                                 (RANDINT, int(args[0]), int(args[1])))
+                position = match.end()
+            split.append(segment[position:])
+        segments = split
+    return tuple(segment for segment in segments if segment != '')
+
+
+def bench_tokenize(paths: list[str], scale: int = 1,
+                   number: int = 20) -> None:
+    """
+    Times both tokenizers over every line of the scripts, after checking
+    that they agree.
+
+    :param paths: Scripts and folders of scripts.
+    :type paths: list[str]
+    :param scale: Times to repeat the lines, to simulate larger scripts.
+    :type scale: int
+    :param number: Timed runs per tokenizer.
+    :type number: int
+    """
+    lines = []
+    for script in find_scripts(paths):
+        with open(script, 'r') as file:
+            lines.extend(line.strip() for line in read_script(file.read()))
+    for line in lines:
+        assert tokenize(line) == three_pass_tokenize(line), line
+    lines *= scale
+    print('tokenize: %d lines, best of 5 x %d runs' % (len(lines), number))
+    results = {}
+    for name, function in (('three pass', three_pass_tokenize),
+                           ('single pass', tokenize)):
+        seconds = min(timeit.repeat(
+            lambda: [function(line) for line in lines],
+            number=number, repeat=5)) / number
+        results[name] = seconds
+        print('  %-12s %10.3f ms  %8.3f us/line' % (
+            name, seconds * 1000, seconds * 1e6 / max(1, len(lines))))
+    print('  speedup      %10.2fx' % (results['three pass'] /
+                                      results['single pass']))
+
+
+def check_query_plans(db: str = DB) -> bool:
+    """
+    Migrates a copy of the database and checks that every hot query is
+    answered through an index rather than a table scan.
+
+    :param db: /path/to/database
+    :type db: str
+    :return: True if every hot query uses an index.
+    :rtype: bool
+    """
+    ok = True
+    with tempfile.TemporaryDirectory() as folder:
+        copy = os.path.join(folder, os.path.basename(db))
+        shutil.copy(db, copy)
+        migrate(copy)
+        con = sqlite3.connect(copy)
+        try:
+            print('query plans:')
+            for name, query, args in HOT_QUERIES:
+                plan = ' / '.join(row[-1] for row in con.execute(
+                    'EXPLAIN QUERY PLAN ' + query, args))
+                indexed = ' USING ' in plan and 'SCAN' not in plan
+                ok = ok and indexed
+                print('  %-4s %-18s %s' % ('ok' if indexed else 'SCAN', name,
+                                           plan))
+        finally:
+            con.close()
+    return ok
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the script engine on the bundled scripts.')
+    parser.add_argument('paths', nargs='*', default=['Scripts'],
+                        help='scripts or folders of scripts')
+    parser.add_argument('--scale', type=int, default=100,
+                        help='times to repeat the lines')
+    parser.add_argument('--db', default=DB,
+                        help='database to check the query plans of')
+    args = parser.parse_args(argv)
+    bench_tokenize(args.paths, args.scale)
+    if not check_query_plans(args.db):
+        raise SystemExit('Some hot queries scan a whole table.')
+
+
+if __name__ == '__main__':
+    main()
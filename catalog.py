@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Persistent index of the installed scripts"""
+from __future__ import annotations
+
+import os
+import random
+import sqlite3
+from threading import Lock
+from typing import NamedTuple
+
+from migrations import migrate
+from script_parser import ANCHOR, CALL, load_script
+
+DB = 'teaseai.db'
+SCRIPTS = './Scripts'
+EXTENSIONS = ('.md', '.txt')
+INFO = '@Info'
+
+
+class ScriptInfo(NamedTuple):
+    """What the catalog knows about one script."""
+    path: str
+    category: str
+    info: str
+    functions: tuple[str, ...]
+    anchors: tuple[str, ...]
+
+
+def describe(path: str, root: str) -> ScriptInfo | None:
+    """
+    Reads the catalog entry of a script.  The category is the folder the
+    script lives in below the scripts folder.
+
+    :param path: /path/to/script
+    :type path: str
+    :param root: /path/to/Scripts
+    :type root: str
+    :return: The entry, or None if the script has no @Info line.
+    :rtype: :class:`ScriptInfo` | None
+    """
+    with open(path, 'r') as file:
+        first = file.readline()
+    if not first.startswith(INFO):
+        return None
+    program = load_script(path)[1]
+    functions = sorted({instruction[1] for instruction in program
+                        if instruction[0] == CALL})
+    anchors = tuple(instruction[1] for instruction in program
+                    if instruction[0] == ANCHOR)
+    category = os.path.dirname(os.path.relpath(path, root))
+    return ScriptInfo(path, category.replace(os.sep, '/'),
+                      first[len(INFO):].strip(), tuple(functions), anchors)
+
+
+class Catalog(object):
+    """
+    Index of the scripts below the scripts folder, kept in the `scripts`
+    table so starting up doesn't mean opening every file.  `refresh()`
+    only reads scripts whose modification time or size changed since they
+    were indexed.
+    """
+
+    def __init__(self, root: str = SCRIPTS, db: str = DB) -> None:
+        """
+        Loads the catalog and brings it up to date.
+
+        Public methods:
+        - refresh(): Index new and changed scripts.
+        - scripts(): List the indexed scripts.
+        - categories(): List the categories.
+        - pick(): Pick a random script.
+
+        :param root: /path/to/Scripts
+        :type root: str
+        :param db: /path/to/database
+        :type db: str
+        """
+        self.root = root
+        self.db = db
+        self.entries: dict[str, ScriptInfo] = {}
+        self.lock = Lock()
+        migrate(db)
+        self.refresh()
+
+    def refresh(self) -> list[str]:
+        """
+        Indexes new and changed scripts and drops deleted ones.
+
+        :return: /path/to/script of every new or changed script.
+        :rtype: list[str]
+        """
+        found: dict[str, tuple[int, int]] = {}
+        for folder, folders, files in os.walk(self.root):
+            folders[:] = [name for name in folders if not name.startswith('.')]
+            for name in files:
+                if name.endswith(EXTENSIONS):
+                    path = os.path.join(folder, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found[path] = (stat.st_mtime_ns, stat.st_size)
+        con = sqlite3.connect(self.db)
+        try:
+            known = {row[0]: (row[1], row[2]) for row in
+                     con.execute('SELECT path, mtime, size FROM scripts')}
+            gone = [(path,) for path in known if path not in found]
+            changed = []
+            for path, stamp in found.items():
+                if known.get(path) == stamp:
+                    continue
+                try:
+                    entry = describe(path, self.root)
+                except (OSError, UnicodeDecodeError, ValueError):
+                    entry = None
+                changed.append((path, *stamp, *(
+                    (entry.category, entry.info, '\n'.join(entry.functions),
+                     '\n'.join(entry.anchors)) if entry is not None
+                    else (None, None, None, None))))
+            with con:
+                con.executemany('DELETE FROM scripts WHERE path = ?', gone)
+                con.executemany('REPLACE INTO scripts VALUES '
+                                '(?, ?, ?, ?, ?, ?, ?)', changed)
+            entries = {}
+            for path, category, info, functions, anchors in con.execute(
+                    'SELECT path, category, info, functions, anchors '
+                    'FROM scripts WHERE info IS NOT NULL'):
+                entries[path] = ScriptInfo(
+                    path, category, info,
+                    tuple(functions.split('\n')) if functions else (),
+                    tuple(anchors.split('\n')) if anchors else ())
+        finally:
+            con.close()
+        with self.lock:
+            self.entries = entries
+        return [row[0] for row in changed]
+
+    def scripts(self, category: str | None = None,
+                function: str | None = None) -> list[ScriptInfo]:
+        """
+        Lists the indexed scripts, optionally only those in a category or
+        calling a function.
+
+        :param category: The category to list, case insensitive.
+        :type category: str | None
+        :param function: A script function the scripts must call.
+        :type function: str | None
+        :return: The matching entries sorted by path.
+        :rtype: list[ScriptInfo]
+        """
+        with self.lock:
+            entries = list(self.entries.values())
+        if category is not None:
+            entries = [entry for entry in entries
+                       if entry.category.lower() == category.lower()]
+        if function is not None:
+            entries = [entry for entry in entries
+                       if function.lower() in entry.functions]
+        return sorted(entries)
+
+    def categories(self) -> list[str]:
+        """
+        Lists the categories that have scripts.
+
+        :return: The category names.
+        :rtype: list[str]
+        """
+        with self.lock:
+            return sorted({entry.category for entry in self.entries.values()})
+
+    def pick(self, category: str) -> ScriptInfo | None:
+        """
+        Picks a random script from a category.
+
+        :param category: The category to pick from.
+        :type category: str
+        :return: The picked entry, or None if the category is empty.
+        :rtype: :class:`ScriptInfo` | None
+        """
+        entries = self.scripts(category)
+        return random.choice(entries) if entries else None
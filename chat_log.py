@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Chat history kept in memory and appended to the database in batches"""
+from __future__ import annotations
+
+import json
+import sqlite3
+import time
+import zlib
+from collections import deque
+
+from write_behind import DB, FLUSH, WriteBehind
+
+HISTORY = 500
+REPLAY = 50
+PAGE = 50
+
+Line = tuple[int, float, str]
+
+
+def pack(lines: list[Line]) -> bytes:
+    """
+    Packs chat lines into the compressed body of a HIS frame.
+
+    :param lines: The id, timestamp and text of each line.
+    :type lines: list[tuple[int, float, str]]
+    :return: The frame body, compressed JSON.
+    :rtype: bytes
+    """
+    return zlib.compress(json.dumps(lines).encode())
+
+
+def unpack(data: bytes) -> list[Line] | None:
+    """
+    Unpacks the body of a HIS frame.
+
+    :param data: The frame body.
+    :type data: bytes
+    :return: The id, timestamp and text of each line, oldest first, or None\
+        if the frame is malformed.
+    :rtype: list[tuple[int, float, str]] | None
+    """
+    try:
+        lines = json.loads(zlib.decompress(data).decode())
+    except (ValueError, zlib.error):
+        return None
+    if not isinstance(lines, list) or not all(
+            isinstance(line, list) and len(line) == 3 and
+            isinstance(line[0], int) and
+            isinstance(line[1], (int, float)) and isinstance(line[2], str)
+            for line in lines):
+        return None
+    return [(line[0], float(line[1]), line[2]) for line in lines]
+
+
+class ChatLog(WriteBehind):
+    """
+    Append-only chat history.  The newest lines are held in a ring buffer
+    for replaying to clients as they join; every line is also appended to
+    the `chat_log` table by a background thread, in one transaction every
+    FLUSH seconds, so older history can be read back a page at a time.
+    """
+
+    def __init__(self, db: str | None = DB, size: int = HISTORY,
+                 interval: float = FLUSH) -> None:
+        """
+        Opens the log and loads its newest lines into the ring buffer.
+
+        Public methods:
+        - append(): Add a line.
+        - recent(): The newest lines.
+        - page(): The lines before a given line.
+        - flush(): Write the pending lines to the database.
+        - close(): Flush and stop the flush thread.
+
+        :param db: /path/to/database, or None to keep history in memory only.
+        :type db: str | None
+        :param size: Lines held in memory.
+        :type size: int
+        :param interval: Seconds between flushes.
+        :type interval: float
+        """
+        self.lines: deque[Line] = deque(maxlen=size)
+        self.pending: list[Line] = []
+        self.last = 0
+        if db is not None:
+            con = sqlite3.connect(db)
+            try:
+                self.lines.extend(reversed(con.execute(
+                    'SELECT id, time, line FROM chat_log ORDER BY id DESC '
+                    'LIMIT ?', (size,)).fetchall()))
+            finally:
+                con.close()
+            if self.lines:
+                self.last = self.lines[-1][0]
+        super().__init__(db, interval)
+
+    def append(self, text: str) -> int:
+        """
+        Adds a line to the history.
+
+        :param text: The line as sent to the clients.
+        :type text: str
+        :return: The id of the line.
+        :rtype: int
+        """
+        with self.cond:
+            self.last += 1
+            line = (self.last, time.time(), text)
+            self.lines.append(line)
+            if self.db is not None:
+                self.pending.append(line)
+            return self.last
+
+    def recent(self, count: int = REPLAY) -> list[Line]:
+        """
+        Returns the newest lines.
+
+        :param count: Number of lines.
+        :type count: int
+        :return: The lines, oldest first.
+        :rtype: list[tuple[int, float, str]]
+        """
+        with self.cond:
+            start = max(0, len(self.lines) - count)
+            return [self.lines[i] for i in range(start, len(self.lines))]
+
+    def page(self, before: int, count: int = PAGE) -> list[Line]:
+        """
+        Returns the lines preceding a line, from memory if the ring buffer
+        still holds them and from the database otherwise.
+
+        :param before: The id of the line to page back from.
+        :type before: int
+        :param count: Number of lines.
+        :type count: int
+        :return: The lines, oldest first.
+        :rtype: list[tuple[int, float, str]]
+        """
+        with self.cond:
+            held = [line for line in self.lines if line[0] < before]
+            if len(held) >= count or self.db is None or (
+                    self.lines and self.lines[0][0] == 1):
+                return held[-count:]
+        # Flushes are serialised, so once this one returns every line
+        # appended so far is in the table.
+        self.flush()
+        con = sqlite3.connect(self.db)
+        try:
+            return list(reversed(con.execute(
+                'SELECT id, time, line FROM chat_log WHERE id < ? '
+                'ORDER BY id DESC LIMIT ?', (before, count)).fetchall()))
+        finally:
+            con.close()
+
+    def _take(self) -> list[tuple]:
+        """Removes and returns the pending lines."""
+        rows, self.pending = self.pending, []
+        return rows
+
+    def _write(self, con: sqlite3.Connection, rows: list[tuple]) -> None:
+        """Appends pending lines."""
+        con.executemany('INSERT INTO chat_log VALUES (?, ?, ?)', rows)
+
+    def _restore(self, rows: list[tuple]) -> None:
+        """Puts back lines that failed to write."""
+        self.pending[:0] = rows
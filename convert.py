@@ -1,9 +1,15 @@
-import re
-import os
+#!/usr/bin/env python3
+"""Converts legacy TeaseAI scripts to the new script syntax"""
+from __future__ import annotations
 
-scripts_dir = 'Scripts/Module'
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
 
-tokens = re.compile(r'@\w*|#\w*|^\(\w*\)')
+scripts_dir = 'Scripts'
 
 swap_dict = {
     '@End': '\nend()',
@@ -27,90 +33,122 @@ swap_dict = {
     'an ass': '_an ass_'
 }
 
-
-def swap(line_list: list[str], i: int, item: str, new_item: str) -> None:
-    """
-    Swaps all occurences of item in a line read from a file with new_item.
-
-    :param line_list: List of lines read from a file.
-    :type line_list: list[str]
-    :param i: index number of line to update.
-    :type i: int
-    :param item: The string to replace.
-    :type item: str
-    :param new_item: The string to replace item with.
-    :type new_item: str
-    """
-    line_list[i] = line_list[i].replace(item, new_item)
+# Longest tokens first so a token never loses to one of its prefixes.
+swaps = re.compile('|'.join(re.escape(token) for token in
+                            sorted(swap_dict, key=len, reverse=True)))
+anchor = re.compile(r'^\((.*)\)\s*$')
 
 
-def convert(lines: list[str]) -> list[str]:
+def convert(lines: Iterable[str]) -> Iterator[str]:
     """
-    Accepts a list of lines from a script file and returns them with all\
-    @tokens #tokens and anchors replaced with new syntax.
-
-    :param lines: A list of lines read from a script file.
-    :type lines: list[str]
-    :returns: A list of converted lines.
-    :rtype: list[str]
+    Converts the lines of a legacy script in a single pass, replacing all\
+    @tokens #tokens and anchors with the new syntax, dropping blank and\
+    @DifferentAnswer lines and quoting dialog.  The @Info line is not moved,\
+    see `convert_file()`.
+
+    :param lines: The lines of a legacy script.
+    :type lines: Iterable[str]
+    :returns: The converted lines.
+    :rtype: Iterator[str]
     """
-    for i, line in enumerate(lines):
+    for line in lines:
+        if '@DifferentAnswer' in line:
+            continue
         if '@StopStroking' in line:
-            lines[i] = 'stopStroking()\n'
-        elif re.match(r'^\(.*\)', line):
-            lines[i] = '# %s\n' % lines[i][1:-2]
-        for x, y in swap_dict.items():
-            if x in line:
-                swap(lines, i, x, y)
-    return lines
-
-
-def convert_step_2(lines: list[str]) -> list[str]:
+            line = 'stopStroking()'
+        else:
+            match = anchor.match(line)
+            if match:
+                line = '# %s' % match.group(1)
+        line = swaps.sub(lambda match: swap_dict[match.group()], line)
+        for part in line.split('\n'):
+            part = part.strip()
+            if not part:
+                continue
+            if part[0].isupper():
+                part = '"%s"' % part
+            yield part + '\n'
+
+
+def convert_file(source: str, destination: str) -> tuple[str, float, str]:
     """
-    Accepts a list of lines from a script file and returns them with all\
-    @DifferentAnswer lines and blank lines removed, and moves the @Info\
-    decorator to the beginning of the file if it exists.
-
-    :param lines: A list of lines read from a script file.
-    :type lines: list[str]
-    :returns: A list of converted lines.
-    :rtype: list[str]
+    Converts one legacy script and writes it with its @Info line first.
+
+    :param source: /path/to/legacy/script
+    :type source: str
+    :param destination: /path/to/converted/script
+    :type destination: str
+    :returns: The source, seconds taken and an error message or ''.
+    :rtype: tuple[str, float, str]
     """
-    for i, line in enumerate(lines):
-        if '@DifferentAnswer' in line:
-            lines.remove(line)
-        elif line.startswith('\n'):
-            swap(lines, i, '\n', "")
-        elif lines[-1].startswith('@Info'):
-            lines.insert(0, lines.pop(-1))
-    return lines
-
-
-script = '/home/michael/projects/teaseme/Tease AI 0.54.9/\
-Scripts/Wicked Tease/Modules/AssOrTitsMan_EDGING.txt'
-with open(script, 'r') as file:
-    lines = file.readlines()
-    filename = os.path.basename(script)
-
-lines: list[str] = convert(lines)
-
-with open('%s/%s' % (scripts_dir, filename), 'w') as file:
-    file.writelines(lines)
-
-with open('%s/%s' % (scripts_dir, filename), 'r') as file:
-    lines: list[str] = file.readlines()
-
-lines: list[str] = convert_step_2(lines)
-
-with open('%s/%s' % (scripts_dir, filename), 'w') as file:
-    file.writelines(lines)
-
-with open('%s/%s' % (scripts_dir, filename), 'r') as file:
-    lines: list[str] = file.readlines()
-
-for i, line in enumerate(lines):
-    if line[0].isupper():
-        swap(lines, i, line, '\"%s\"\n' % line.strip())
-
-with open('%s/%s' % (scripts_dir, filename), 'w') as file:
-    file.writelines(lines)
+    start = time.perf_counter()
+    try:
+        info, body = [], []
+        with open(source, 'r', errors='replace') as file:
+            for line in convert(file):
+                (info if line.startswith('@Info') else body).append(line)
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        with open(destination, 'w') as file:
+            file.writelines(info[:1] + body)
+    except (OSError, ValueError) as error:
+        return source, time.perf_counter() - start, str(error)
+    return source, time.perf_counter() - start, ''
+
+
+def convert_tree(source: str, destination: str,
+                 workers: int | None = None) -> list[tuple[str, float, str]]:
+    """
+    Converts every script in a legacy scripts folder in parallel, keeping the
+    folder layout.
+
+    :param source: /path/to/legacy/Scripts
+    :type source: str
+    :param destination: /path/to/new/Scripts
+    :type destination: str
+    :param workers: Number of worker processes, defaults to the number of\
+        CPUs.
+    :type workers: int | None
+    :returns: The source, seconds taken and error message of each script.
+    :rtype: list[tuple[str, float, str]]
+    """
+    jobs = []
+    for folder, _, files in os.walk(source):
+        for name in sorted(files):
+            if name.lower().endswith('.txt'):
+                path = os.path.join(folder, name)
+                jobs.append((path, os.path.join(
+                    destination, os.path.relpath(path, source))))
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(convert_file, *zip(*jobs), chunksize=16)) \
+            if jobs else []
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(
+        description='Convert legacy TeaseAI scripts to the new syntax.')
+    parser.add_argument('source', help='legacy script or scripts folder')
+    parser.add_argument('-o', '--output', default=scripts_dir,
+                        help='folder to write converted scripts to')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes')
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    if os.path.isdir(args.source):
+        results = convert_tree(args.source, args.output, args.jobs)
+    else:
+        results = [convert_file(args.source, os.path.join(
+            args.output, os.path.basename(args.source)))]
+    failed = 0
+    for path, seconds, error in results:
+        if error:
+            failed += 1
+            print('FAILED %s: %s' % (path, error))
+        else:
+            print('%8.2f ms  %s' % (seconds * 1000, path))
+    print('Converted %d of %d scripts in %.2f s.' % (
+        len(results) - failed, len(results), time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -152,7 +152,7 @@ def get_image(filename: str) -> bytes:
     with BytesIO() as bio:
         image.save(bio, format="PNG")
         del image
-    return bio.getvalue()
+        return bio.getvalue()
 
 
 def send_package(pub_key: rsa.RSAPublicKey,
@@ -169,15 +169,16 @@ def send_package(pub_key: rsa.RSAPublicKey,
 
     :param pub_key: The RSA Public Key to use to encrypt the header.
     :type pub_key: :class:`rsa.RSAPublicKey`
-    :param msg: The data to be transmitted.
+    :param msg: The data to be transmitted.  For IMG, either the encoded\
+        image or the path to an image to read and encode.
     :type msg: `str` or  `bytes`
     :param type: The type of transmission, one of MSG, IMG, SES, or FOL
     :type type: `str`
     :return: The packaged transmission.
     :rtype: `bytes`
     """
-    if msg_type == 'IMG':
-        get_image(str(msg))
+    if msg_type == 'IMG' and isinstance(msg, str):
+        msg = get_image(msg)
 
     f_key = Fernet.generate_key()
     out_msg = Fernet(f_key).encrypt(_bytes(msg))
@@ -194,6 +195,21 @@ def send_package(pub_key: rsa.RSAPublicKey,
     return header + signature + out_msg
 
 
+def _recv(socket: socket, length: int) -> bytes:
+    """
+    Receive exactly `length` bytes from a socket, or fewer if the connection
+    closes first.  A single `recv()` may return only part of a large frame.
+    """
+    chunks = []
+    while length > 0:
+        chunk = socket.recv(length)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        length -= len(chunk)
+    return b''.join(chunks)
+
+
 def open_package(public_key: rsa.RSAPublicKey,
                  private_key: rsa.RSAPrivateKeyWithSerialization,
                  socket: socket) -> tuple[str, bytes]:
@@ -201,15 +217,15 @@ def open_package(public_key: rsa.RSAPublicKey,
     Receive a packaged transmission over a socket, decrypt the header, verify
     the signature, and finally decrypt and return the content.
     """
-    enc_header = socket.recv(512)
-    signature = socket.recv(512)
+    enc_header = _recv(socket, 512)
+    signature = _recv(socket, 512)
     header = decrypt(private_key, enc_header)
     try:
         verify(public_key, header, signature)
         (msg_type, length, f_key) = (header[0:3].decode(),
                                      int(header[3:13].decode()),
                                      header[13:])
-        enc_msg = socket.recv(length)
+        enc_msg = _recv(socket, length)
         msg = Fernet(f_key).decrypt(enc_msg)
         return (msg_type, msg)
     except InvalidSignature:
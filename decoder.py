@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Image decoding off the network thread"""
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable
+
+
+class Decoder(object):
+    """
+    Decodes images on a small pool of worker threads so the network thread
+    can keep reading while images decode.
+    """
+
+    def __init__(self, decode: Callable[[bytes], Any],
+                 workers: int = 2) -> None:
+        """
+        Initializes the decoder.
+
+        Public methods:
+        - latest(): Decode an image that supersedes every earlier one.
+        - schedule(): Decode an image that is wanted in its own right.
+
+        :param decode: Function that decodes an image.
+        :type decode: Callable[[bytes], Any]
+        :param workers: Number of decoding threads.
+        :type workers: int
+        """
+        self.decode = decode
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='decode')
+        self.lock = Lock()
+        self.submitted = 0
+        self.delivered = 0
+
+    def latest(self, data: bytes, callback: Callable[[Any], None]) -> None:
+        """
+        Decodes an image and hands it to the callback, unless a newer image
+        was submitted in the meantime.  Superseded images are dropped
+        without being decoded if they haven't started yet, and never
+        delivered after a newer one.
+
+        :param data: The encoded image.
+        :type data: bytes
+        :param callback: Receives the decoded image.
+        :type callback: Callable[[Any], None]
+        """
+        with self.lock:
+            self.submitted += 1
+            sequence = self.submitted
+        self.pool.submit(self._latest, sequence, data, callback)
+
+    def _latest(self, sequence: int, data: bytes,
+                callback: Callable[[Any], None]) -> None:
+        """Worker side of `latest()`."""
+        if sequence < self.submitted:
+            return
+        image = self.decode(data)
+        with self.lock:
+            if sequence < self.delivered:
+                return
+            self.delivered = sequence
+            callback(image)
+
+    def schedule(self, data: bytes, callback: Callable[[Any], None],
+                 stale: Callable[[], bool] = lambda: False) -> None:
+        """
+        Decodes an image and hands it to the callback.
+
+        :param data: The encoded image.
+        :type data: bytes
+        :param callback: Receives the decoded image.
+        :type callback: Callable[[Any], None]
+        :param stale: Checked before decoding, the image is dropped if it\
+            returns True.
+        :type stale: Callable[[], bool]
+        """
+        def work() -> None:
+            if not stale():
+                callback(self.decode(data))
+        self.pool.submit(work)
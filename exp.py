@@ -2,11 +2,13 @@
 """Client class and associated methods"""
 from __future__ import annotations
 
+import heapq
 import os
 import pickle
 import sys
 import time as t
 from io import BytesIO
+from queue import Empty, SimpleQueue
 from socket import AF_INET, SOCK_STREAM, socket
 from threading import Lock, Thread
 from cv2 import cvtColor, COLOR_BGR2RGB, VideoCapture, CAP_PROP_POS_FRAMES #pylint: disable=no-name-in-module
@@ -22,11 +24,16 @@ from PySide6.QtGui import QImage, QPixmap # pylint: disable=no-name-in-module
 from PySide6.QtWidgets import QApplication, QDialog, QMainWindow # pylint: disable=no-name-in-module
 
 from crypto_functions import get_key_pair, open_package, send_package
+from decoder import Decoder
+from image_cache import ImageCache
 from qt_windows import LoginBuilder, UIBuilder
-from server import Server
+from server import Server, read_listing_page
 from usersettings import UserSettings
 from video_no_vlc import Player
 
+WANTED = 5.0
+REPLY = 30.0
+
 def load_options() -> UserSettings:
     """
     Load the config file or load defaults
@@ -46,6 +53,8 @@ def load_options() -> UserSettings:
         "HOST_FOLDER": os.path.expanduser("~"),
         "BOOBS_FOLDER": os.path.expanduser("~"),
         "BUTTS_FOLDER": os.path.expanduser("~"),
+        "CACHE_FOLDER": os.path.expanduser("~/.cache/teaseai"),
+        "CACHE_SIZE": 512 * 1024 * 1024,
         "UPDATES": False,
     }
 
@@ -94,6 +103,7 @@ class MainWindow(QMainWindow):
         """Checks the queue for a new image to display."""
         media_size = self.inter.media.contentsRect()
         self.client.media_size = media_size.width(), media_size.height()
+        self.client.present_slides()
         if self.client.media is not None:
             self.inter.media.setPixmap(QPixmap.fromImage(self.client.media))
 
@@ -157,8 +167,8 @@ class Client:
             """Initialize the session."""
             self.srv_folder = "Not Connected."
             self.online_users = []
-            self.browser_folders = ["None"]
-            self.browser_files = ["None"]
+            self.browser_pages: SimpleQueue[dict] = SimpleQueue()
+            self.replies: SimpleQueue[bytes] = SimpleQueue()
             self.srv_key = key
 
     def __init__(self) -> None:
@@ -176,9 +186,19 @@ class Client:
         self.socket = socket(AF_INET, SOCK_STREAM)
         self.socket.settimeout(5)
         self.connected = False
-        self.recv_lock = Lock()
+        self.send_lock = Lock()
         self.status = "Not connected."
         self.media = None
+        self.cache = ImageCache(self.settings["CACHE_FOLDER"],
+                                self.settings["CACHE_SIZE"])
+        self.wanted: dict[str, list[tuple[int, float]]] = {}
+        self.requested: dict[str, float] = {}
+        self.decoder = Decoder(self._decode_image)
+        self.slides: list[tuple[float, int, QImage]] = []
+        self.slide_lock = Lock()
+        self.slide_generation = 0
+        self.slide_count = 0
+        self.clock_offset: float | None = None
         self.window = MainWindow(self)
         media_size = self.window.inter.media.contentsRect()
         self.media_size = media_size.width(), media_size.height()
@@ -209,16 +229,16 @@ class Client:
             key = load_pem_public_key(self.socket.recv(833))
             if isinstance(key, rsa.RSAPublicKey):
                 self.session = self.Session(key)
+                recv_thread = Thread(
+                    target=self._receive_messages, daemon=True
+                )
+                recv_thread.start()
                 response = self._authenticate()
                 while response != "True":
                     if response is None:
                         break
                     response = self._authenticate()
                 if response == "True":
-                    recv_thread = Thread(
-                        target=self._receive_messages, daemon=True
-                    )
-                    recv_thread.start()
                     settings = pickle.dumps(self.settings)
                     self.send_message(settings, "SES")
                     self.connected = True
@@ -227,12 +247,14 @@ class Client:
 
     def _authenticate(self) -> bool | str | None:
         """
-        Authenticate on the server. Returns the server's response.
+        Authenticate on the server. Returns the server's response, which
+        the receive thread passes on through the session's reply queue.
 
         :param last: The server's response to previous attempt to
             authenticate.
         :type last: `str`
-        :return: The server's response or None if window was closed.
+        :return: The server's response or None if window was closed or\
+            the server did not answer within REPLY seconds.
         :rtype: `Any`
         """
         login = LoginWindow(self.window, self)
@@ -242,16 +264,10 @@ class Client:
             if self.settings["SAVE_CREDENTIALS"]:
                 self.settings["USERNAME"] = username
             self.send_message("%s %s" % (username, password), "LOG")
-            self.recv_lock.acquire()
-            msg_type, answer = self.recv()
-            self.recv_lock.release()
-            if msg_type == "LOG":
-                return answer.decode()
-
-    def recv(self):
-        """Receive a message from the server."""
-        return open_package(self.session.srv_key, self.private_key,
-                            self.socket)
+            try:
+                return self.session.replies.get(timeout=REPLY).decode()
+            except Empty:
+                return None
 
     def send_message(self, msg: str | bytes, msg_type: str) -> None:
         """
@@ -259,53 +275,195 @@ class Client:
 
         :param msg: Message to send.
         :type msg: string
-        :param msg_type: The type of transmission, one of MSG, IMG, SES, FOL
-            or LOG
+        :param msg_type: The type of transmission, one of MSG, IMG, GET, SES,
+            FOL or LOG
         :type msg_type: `str`
         """
-        send_package(
-            self.session.srv_key, self.private_key, msg, msg_type, self.socket
-        )
+        with self.send_lock:
+            send_package(
+                self.session.srv_key, self.private_key, msg, msg_type,
+                self.socket
+            )
 
     def _receive_messages(self) -> None:
         """Receive messages from the server."""
         while True:
             try:
-                self.recv_lock.acquire()
                 msg_type, msg = open_package(
                     self.session.srv_key, self.private_key, self.socket
                 )
-                self.recv_lock.release()
                 if len(msg) == 0:
                     break
-                if msg_type == "MSG":
+                if msg_type == "LOG":
+                    self.session.replies.put(msg)
+                elif msg_type == "MSG":
                     self.window.inter.chat.appendPlainText(msg.decode())
                 elif msg_type == "SES":
                     self._set_session_vars(msg.decode())
                     continue
                 elif msg_type == "FOL":
-                    self._folders_and_files(msg.decode())
+                    self._folders_and_files(msg)
                     continue
                 elif msg_type == "IMG":
-                    img = Image.open(BytesIO(msg))
-                    rgb = cvtColor(img, COLOR_BGR2RGB)
-                    height, width, chars = rgb.shape
-                    bytes_per_line = chars * width
-                    qimg = QImage(rgb.data, width, height, bytes_per_line,  # type: ignore
-                                  QImage.Format_RGB888)
-                    image = qimg.scaled(
-                        *self.media_size,
-                        Qt.KeepAspectRatio,
-                        Qt.FastTransformation,
-                    )
-                    self.media = image
+                    self.decoder.latest(msg, self._set_media)
+                    continue
+                elif msg_type == "SLD":
+                    self._announce_slide(msg.decode())
+                    continue
+                elif msg_type == "BLB":
+                    self._receive_blob(msg)
                     continue
                 elif msg_type == "ERR":
                     self.status = msg
             except OSError:
-                self.recv_lock.release()
-            finally:
-                t.sleep(0.1)
+                continue
+
+    def _set_media(self, image: QImage) -> None:
+        """
+        Displays a decoded image.
+
+        :param image: The decoded image.
+        :type image: :class:`QImage`
+        """
+        with self.slide_lock:
+            self.media = image
+
+    def _decode_image(self, data: bytes) -> QImage:
+        """
+        Decodes an image received from the server and scales it to the media
+        pane.
+
+        :param data: The encoded image.
+        :type data: bytes
+        :return: The decoded and scaled image.
+        :rtype: :class:`QImage`
+        """
+        img = Image.open(BytesIO(data))
+        rgb = cvtColor(img, COLOR_BGR2RGB)
+        height, width, chars = rgb.shape
+        bytes_per_line = chars * width
+        qimg = QImage(rgb.data, width, height, bytes_per_line,  # type: ignore
+                      QImage.Format_RGB888)
+        return qimg.scaled(
+            *self.media_size,
+            Qt.KeepAspectRatio,
+            Qt.FastTransformation,
+        )
+
+    def _announce_slide(self, msg: str) -> None:
+        """
+        Handles a slide announced ahead of time by the server.  The offset
+        between the server's clock and ours is estimated as the smallest
+        observed difference between the send and receive times, so every
+        client swaps at the same moment give or take the difference in their
+        best-case latency.  Slides already in the cache are buffered right
+        away, others are requested from the server by hash.  Requests left
+        unanswered for WANTED seconds are sent again if the slide is
+        announced again, and dropped otherwise.
+
+        :param msg: Generation, send time, presentation time and content\
+            hash, separated by colons.
+        :type msg: str
+        """
+        generation, sent_at, present_at, key = msg.split(":")
+        offset = t.time() - float(sent_at)
+        if self.clock_offset is None or offset < self.clock_offset:
+            self.clock_offset = offset
+        if int(generation) < self.slide_generation:
+            return
+        data = self.cache.get(key)
+        if data is not None:
+            self._buffer_slide(int(generation), float(present_at), data)
+        else:
+            self.wanted.setdefault(key, []).append((int(generation),
+                                                    float(present_at)))
+            now = t.monotonic()
+            for stale, requested in list(self.requested.items()):
+                if now - requested >= WANTED and stale != key:
+                    del self.requested[stale]
+                    self.wanted.pop(stale, None)
+            if now - self.requested.get(key, now - WANTED) >= WANTED:
+                self.requested[key] = now
+                self.send_message(key, "GET")
+
+    def _receive_blob(self, msg: bytes) -> None:
+        """
+        Stores the body of a requested slide in the cache and buffers every
+        announcement that was waiting for it.  An empty body means the server
+        no longer has the slide, which is then skipped.
+
+        :param msg: The content hash and the encoded image, separated by a\
+            colon.
+        :type msg: bytes
+        """
+        key, data = msg.split(b":", 1)
+        key = key.decode()
+        self.requested.pop(key, None)
+        if not data:
+            self.wanted.pop(key, None)
+            self.status = "Error: slide %s expired on the server" % key
+            return
+        if not self.cache.put(key, data):
+            self.status = "Error: corrupt slide %s" % key
+        for generation, present_at in self.wanted.pop(key, []):
+            self._buffer_slide(generation, present_at, data)
+
+    def _buffer_slide(self, generation: int, present_at: float,
+                      data: bytes) -> None:
+        """
+        Decodes a slide off the network thread and buffers it until its
+        presentation time.  Slides from a superseded generation are dropped,
+        decoded or not.
+
+        :param generation: The slideshow generation the slide belongs to.
+        :type generation: int
+        :param present_at: Server timestamp at which to display the slide.
+        :type present_at: float
+        :param data: The encoded image.
+        :type data: bytes
+        """
+        with self.slide_lock:
+            if generation < self.slide_generation:
+                return
+            if generation > self.slide_generation:
+                self.slide_generation = generation
+                self.slides.clear()
+        self.decoder.schedule(
+            data,
+            lambda image: self._queue_slide(generation, present_at, image),
+            lambda: generation < self.slide_generation,
+        )
+
+    def _queue_slide(self, generation: int, present_at: float,
+                     image: QImage) -> None:
+        """
+        Buffers a decoded slide until its presentation time.
+
+        :param generation: The slideshow generation the slide belongs to.
+        :type generation: int
+        :param present_at: Server timestamp at which to display the slide.
+        :type present_at: float
+        :param image: The decoded image.
+        :type image: :class:`QImage`
+        """
+        with self.slide_lock:
+            if generation < self.slide_generation:
+                return
+            self.slide_count += 1
+            heapq.heappush(self.slides, (present_at, self.slide_count,
+                                         image))
+
+    def present_slides(self) -> None:
+        """
+        Swaps in the latest buffered slide whose time has come.  When the
+        client has fallen behind, the earlier due slides are skipped.
+        """
+        if self.clock_offset is None:
+            return
+        now = t.time() - self.clock_offset
+        with self.slide_lock:
+            while self.slides and self.slides[0][0] <= now:
+                self.media = heapq.heappop(self.slides)[2]
 
     def _set_session_vars(self, msg: str) -> None:
         """
@@ -321,24 +479,18 @@ class Client:
             if chunk != "END":
                 self.session.online_users.append(chunk)
 
-    def _folders_and_files(self, msg: str) -> None:
+    def _folders_and_files(self, msg: bytes) -> None:
         """
-        Passes retrieved folder and file information to the server browser
-            object.
+        Passes a page of folder and file information retrieved from the
+        server to the server browser object.
 
-        :param msg: A message packet from the server containing the folder and
-            file information.
-        :type msg: string
+        :param msg: A message packet from the server containing a page of
+            the folder listing as JSON.
+        :type msg: bytes
         """
-        browse_data = msg.split(":")
-        try:
-            self.session.browser_folders = browse_data[1].split(",")
-        except IndexError:
-            pass
-        try:
-            self.session.browser_files = browse_data[3].split(",")
-        except IndexError:
-            pass
+        page = read_listing_page(msg)
+        if page is not None:
+            self.session.browser_pages.put(page)
 
 
 class Video(QThread):
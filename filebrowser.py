@@ -2,11 +2,11 @@
 """Custom filebrowser class and associated functions."""
 from __future__ import annotations
 import os
-from io import BytesIO
 
-from PIL import Image, ImageOps
 import PySimpleGUI as sG
 
+from thumbnails import get_thumbnails
+
 
 class FileBrowser():
     """Class for custom file browser widget."""
@@ -23,6 +23,7 @@ class FileBrowser():
         """
         self.history = history
         self.path = path
+        self.selected: str | None = None
         self.treedata = sG.TreeData()
         self.layout = [
             [sG.B('', image_filename='icons/browse_back.png', k='BACK',
@@ -98,19 +99,30 @@ class FileBrowser():
 
     def preview(self, image: str, size: tuple[int, int]) -> None:
         """
-        Display an image in the preview pane.
+        Display an image in the preview pane.  The thumbnail is generated in
+        the background and posted back to the event loop when it is ready.
 
         :param image: The path to the image file to preview.
         :type image: string
         :param size: The size to scale the image to. (width, height)
         :type size: tuple[int, int]
         """
-        img = Image.open(image)
-        img = ImageOps.pad(img, size=size)
-        with BytesIO() as bio:
-            img.save(bio, format="PNG")
-            del img
-            self.window['IMAGE'].update(data=bio.getvalue())
+        self.selected = image
+        future = get_thumbnails().get(image, size)
+        future.add_done_callback(lambda done: self.window.write_event_value(
+            'THUMBNAIL', (image, done)))
+
+    def _show_thumbnail(self, image: str, future) -> None:
+        """
+        Displays a finished thumbnail if its image is still selected.
+
+        :param image: The path to the image file the thumbnail is for.
+        :type image: string
+        :param future: The finished thumbnail future.
+        :type future: :class:`Future`
+        """
+        if image == self.selected and future.exception() is None:
+            self.window['IMAGE'].update(data=future.result())
 
     def select_folder(self, values: dict) -> str:
         """
@@ -136,6 +148,9 @@ class FileBrowser():
             event, values = self.window.read()
             if event in ['Cancel', sG.WIN_CLOSED]:
                 break
+            if event == 'THUMBNAIL':
+                self._show_thumbnail(*values[event])
+                continue
             if event == 'UP':
                 self._change_path(os.path.dirname(self.path))
             if event == 'BACK':
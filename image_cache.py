@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Persistent content-addressed image cache for the client"""
+from __future__ import annotations
+
+import hashlib
+import os
+from collections import OrderedDict
+from threading import Lock
+
+
+def digest(data: bytes) -> str:
+    """
+    Returns the content address of a blob.
+
+    :param data: The blob to hash.
+    :type data: bytes
+    :return: Hex encoded SHA-256 of the blob.
+    :rtype: str
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class ImageCache(object):
+    """
+    On-disk cache of images keyed by their SHA-256, capped at a total size
+    and evicting the least recently used entries first.  Recency survives
+    restarts through the files' modification times.
+    """
+
+    def __init__(self, folder: str, max_bytes: int) -> None:
+        """
+        Opens the cache, creating the folder if needed.
+
+        Public methods:
+        - get(): Retrieve a blob by its digest.
+        - put(): Store a blob.
+
+        :param folder: /path/to/folder holding the cached files.
+        :type folder: str
+        :param max_bytes: Maximum total size of the cached files.
+        :type max_bytes: int
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.lock = Lock()
+        os.makedirs(folder, exist_ok=True)
+        files = []
+        for entry in os.scandir(folder):
+            if entry.is_file() and len(entry.name) == 64:
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.size += size
+        self._evict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key)
+
+    def get(self, key: str) -> bytes | None:
+        """
+        Retrieves a blob and marks it as recently used.
+
+        :param key: The digest of the blob.
+        :type key: str
+        :return: The blob, or None if it is not cached.
+        :rtype: bytes | None
+        """
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self._path(key), 'rb') as file:
+                data = file.read()
+            os.utime(self._path(key))
+        except OSError:
+            with self.lock:
+                self.size -= self.entries.pop(key, 0)
+            return None
+        return data
+
+    def put(self, key: str, data: bytes) -> bool:
+        """
+        Stores a blob if its content matches the digest.
+
+        :param key: The digest the blob was announced under.
+        :type key: str
+        :param data: The blob.
+        :type data: bytes
+        :return: True if the blob was stored.
+        :rtype: bool
+        """
+        if digest(data) != key or len(data) > self.max_bytes:
+            return False
+        temp = self._path(key) + '.tmp'
+        with open(temp, 'wb') as file:
+            file.write(data)
+        os.replace(temp, self._path(key))
+        with self.lock:
+            self.size += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self._evict()
+        return True
+
+    def _evict(self) -> None:
+        """Deletes least recently used blobs until the cache fits."""
+        while self.size > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
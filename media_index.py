@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Named pools of media files for the AI to pick from"""
+from __future__ import annotations
+
+import os
+import random
+import time
+from threading import Lock
+
+EXTENSIONS = ('png', 'jpg', 'jpeg', 'tiff', 'bmp')
+REFRESH = 5.0
+
+
+class MediaPool(object):
+    """The images found in one folder."""
+
+    def __init__(self, name: str, folder: str) -> None:
+        """
+        Initializes an empty pool.
+
+        :param name: The category name scripts refer to the pool by.
+        :type name: str
+        :param folder: /path/to/folder holding the images.
+        :type folder: str
+        """
+        self.name = name
+        self.folder = folder
+        self.images: list[str] = []
+        self.mtime = -1
+        self.checked = 0.0
+
+    def refresh(self) -> None:
+        """Rescans the folder if it changed since the last scan."""
+        self.checked = time.monotonic()
+        try:
+            mtime = os.stat(self.folder).st_mtime_ns
+            if mtime == self.mtime:
+                return
+            with os.scandir(self.folder) as entries:
+                self.images = sorted(
+                    entry.path for entry in entries
+                    if entry.name.lower().endswith(EXTENSIONS) and
+                    entry.is_file())
+            self.mtime = mtime
+        except OSError:
+            self.images = []
+            self.mtime = -1
+
+
+class MediaIndex(object):
+    """
+    Keeps pools of images built once per folder and rescanned only when the
+    folder changes, so picking a random image is a constant time operation.
+    The folder of a named pool is looked up on every sample: the server
+    option `pool-<name>`, or failing that the `<NAME>_FOLDER` setting of the
+    requesting client, or else of the client with ops.  Changes to either
+    take effect on the next sample.
+    """
+
+    def __init__(self, server) -> None:
+        """
+        Initializes the media index.
+
+        Public methods:
+        - pool(): Get the pool of a folder.
+        - sample(): Pick a random image from a named pool.
+
+        :param server: An instance of the `Server` object.
+        :type server: :class:`Server`
+        """
+        self.server = server
+        self.pools: dict[str, MediaPool] = {}
+        self.lock = Lock()
+
+    def _folder(self, name: str, person=None) -> str | None:
+        """
+        Finds the folder configured for a pool.
+
+        :param name: The name of the pool.
+        :type name: str
+        :param person: The client the image is for.
+        :type person: :class:`Person` | None
+        :return: /path/to/folder or None if the pool isn't configured.
+        :rtype: str | None
+        """
+        folder = self.server.opt_get('pool-%s' % name)
+        if folder is None:
+            setting = '%s_FOLDER' % name.upper()
+            people = [] if person is None else [person]
+            people += [client for client in self.server.clients
+                       if client.ops]
+            for client in people:
+                folder = client.options.get(setting)
+                if folder is not None:
+                    break
+        return folder
+
+    def pool(self, name: str, folder: str) -> MediaPool:
+        """
+        Returns the pool of a folder, scanning the folder the first time.
+
+        :param name: The name of the pool.
+        :type name: str
+        :param folder: /path/to/folder holding the images.
+        :type folder: str
+        :return: The pool.
+        :rtype: :class:`MediaPool`
+        """
+        key = os.path.abspath(folder)
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = self.pools[key] = MediaPool(name, folder)
+                pool.refresh()
+        return pool
+
+    def sample(self, name: str, person=None) -> str | None:
+        """
+        Picks a random image from a pool.
+
+        :param name: The name of the pool.
+        :type name: str
+        :param person: The client the image is for.
+        :type person: :class:`Person` | None
+        :return: /path/to/image or None if the pool is empty or unknown.
+        :rtype: str | None
+        """
+        folder = self._folder(name.lower(), person)
+        if folder is None:
+            return None
+        pool = self.pool(name, folder)
+        if time.monotonic() - pool.checked > REFRESH:
+            with self.lock:
+                pool.refresh()
+        if not pool.images:
+            return None
+        return random.choice(pool.images)
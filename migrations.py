@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Versioned schema migrations for the TeaseAI database"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+from threading import Lock
+from typing import Callable
+
+from vocabulary import rebuild_clusters
+
+DB = 'teaseai.db'
+
+_lock = Lock()
+
+
+def _base(con: sqlite3.Connection) -> None:
+    """
+    Version 1: the original schema, so new databases can be created from
+    scratch.  Existing databases already have these tables.
+    """
+    con.execute('CREATE TABLE IF NOT EXISTS "users" ("username" TEXT, '
+                '"password" TEXT, "salt" BLOB, "chat_name" TEXT, '
+                '"online" INTEGER)')
+    con.execute('CREATE TABLE IF NOT EXISTS "options" ("name" TEXT, '
+                '"setting" TEXT)')
+    con.execute('CREATE TABLE IF NOT EXISTS "vocab" ("SynID" INTEGER, '
+                '"word" TEXT NOT NULL UNIQUE, '
+                'PRIMARY KEY("SynID" AUTOINCREMENT))')
+    con.execute('CREATE TABLE IF NOT EXISTS "synonyms" ('
+                '"ParentSynID" INT CHECK("ParentSynID" != "SynID"), '
+                '"SynID" INT, '
+                '"Key" TEXT UNIQUE GENERATED ALWAYS AS '
+                '(CAST("ParentSynID" AS TEXT) || CAST("SynID" AS TEXT)) '
+                'STORED, '
+                'FOREIGN KEY("ParentSynID") REFERENCES "vocab"("SynID"), '
+                'FOREIGN KEY("SynID") REFERENCES "vocab"("SynID"))')
+
+
+def _keys_and_indexes(con: sqlite3.Connection) -> None:
+    """
+    Version 2: index both ends of the synonym graph, and key users by
+    username and options by name.  Duplicate usernames and option names
+    keep their first row.
+    """
+    con.execute('CREATE INDEX IF NOT EXISTS synonyms_parent '
+                'ON synonyms(ParentSynID)')
+    con.execute('CREATE INDEX IF NOT EXISTS synonyms_child ON synonyms(SynID)')
+    con.execute('CREATE TABLE users_new ("username" TEXT PRIMARY KEY, '
+                '"password" TEXT, "salt" BLOB, "chat_name" TEXT, '
+                '"online" INTEGER)')
+    con.execute('INSERT OR IGNORE INTO users_new SELECT username, password, '
+                'salt, chat_name, online FROM users '
+                'WHERE username IS NOT NULL ORDER BY rowid')
+    con.execute('DROP TABLE users')
+    con.execute('ALTER TABLE users_new RENAME TO users')
+    con.execute('CREATE TABLE options_new ("name" TEXT PRIMARY KEY, '
+                '"setting" TEXT)')
+    con.execute('INSERT OR IGNORE INTO options_new SELECT name, setting '
+                'FROM options WHERE name IS NOT NULL ORDER BY rowid')
+    con.execute('DROP TABLE options')
+    con.execute('ALTER TABLE options_new RENAME TO options')
+
+
+def _scripts(con: sqlite3.Connection) -> None:
+    """Version 3: the script catalog."""
+    con.execute('CREATE TABLE IF NOT EXISTS scripts ('
+                'path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, '
+                'category TEXT, info TEXT, functions TEXT, anchors TEXT)')
+
+
+def _clusters(con: sqlite3.Connection) -> None:
+    """
+    Version 4: the cluster of synonyms each word belongs to, kept up to date
+    by triggers on insert: a new word starts its own cluster and a new
+    synonym merges the clusters of its two words.
+    """
+    con.execute('CREATE TABLE clusters ('
+                '"SynID" INTEGER PRIMARY KEY REFERENCES "vocab"("SynID"), '
+                '"ClusterID" INTEGER NOT NULL)')
+    con.execute('CREATE INDEX clusters_cluster ON clusters(ClusterID)')
+    con.execute('CREATE TRIGGER vocab_cluster AFTER INSERT ON vocab BEGIN '
+                'INSERT OR IGNORE INTO clusters VALUES (NEW.SynID, '
+                'NEW.SynID); END')
+    con.execute('CREATE TRIGGER vocab_uncluster AFTER DELETE ON vocab BEGIN '
+                'DELETE FROM clusters WHERE SynID = OLD.SynID; END')
+    con.execute('CREATE TRIGGER synonyms_cluster AFTER INSERT ON synonyms '
+                'BEGIN UPDATE clusters SET ClusterID = ('
+                'SELECT min(ClusterID) FROM clusters '
+                'WHERE SynID IN (NEW.ParentSynID, NEW.SynID)) '
+                'WHERE ClusterID IN (SELECT ClusterID FROM clusters '
+                'WHERE SynID IN (NEW.ParentSynID, NEW.SynID)); END')
+    rebuild_clusters(con)
+
+
+def _user_state(con: sqlite3.Connection) -> None:
+    """Version 5: the flags and variables scripts keep per user."""
+    con.execute('CREATE TABLE user_state ('
+                'username TEXT, key TEXT, value BLOB, '
+                'PRIMARY KEY(username, key)) WITHOUT ROWID')
+
+
+def _chat_log(con: sqlite3.Connection) -> None:
+    """Version 6: the append-only chat history."""
+    con.execute('CREATE TABLE chat_log ('
+                'id INTEGER PRIMARY KEY, time REAL, line TEXT)')
+
+
+def _vocab_version(con: sqlite3.Connection) -> None:
+    """
+    Version 7: a counter bumped by triggers on every change to the vocab and
+    synonyms tables, so the in-memory vocabulary reloads only when they
+    change and not whenever another table in the database is written.
+    """
+    con.execute('CREATE TABLE vocab_version ('
+                'id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER)')
+    con.execute('INSERT INTO vocab_version VALUES (0, 1)')
+    for table in ('vocab', 'synonyms'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            con.execute('CREATE TRIGGER %s_%s_version AFTER %s ON %s BEGIN '
+                        'UPDATE vocab_version SET version = version + 1; '
+                        'END' % (table, event.lower(), event, table))
+
+
+# Append new migrations, never edit or reorder released ones.  The schema
+# version of a database is the number of migrations applied to it.
+MIGRATIONS: list[Callable[[sqlite3.Connection], None]] = [
+    _base,
+    _keys_and_indexes,
+    _scripts,
+    _clusters,
+    _user_state,
+    _chat_log,
+    _vocab_version,
+]
+
+
+def version(db: str = DB) -> int:
+    """
+    Returns the schema version of a database.
+
+    :param db: /path/to/database
+    :type db: str
+    :return: The number of migrations applied.
+    :rtype: int
+    """
+    con = sqlite3.connect(db)
+    try:
+        return con.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        con.close()
+
+
+def migrate(db: str = DB) -> int:
+    """
+    Upgrades a database in place by applying the migrations it is missing.
+    Each migration runs in its own transaction together with the bump of
+    the schema version, so an interrupted upgrade resumes where it failed.
+
+    :param db: /path/to/database
+    :type db: str
+    :return: The schema version after the upgrade.
+    :rtype: int
+    """
+    with _lock:
+        con = sqlite3.connect(db, isolation_level=None)
+        try:
+            current = con.execute('PRAGMA user_version').fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS[current:],
+                                               current + 1):
+                con.execute('BEGIN IMMEDIATE')
+                try:
+                    migration(con)
+                    con.execute('PRAGMA user_version = %d' % number)
+                    con.execute('COMMIT')
+                except BaseException:
+                    con.execute('ROLLBACK')
+                    raise
+                current = number
+            return current
+        finally:
+            con.close()
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else DB
+    before = version(path)
+    print('%s: schema version %d -> %d' % (path, before, migrate(path)))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Lazy shuffled playlist with a bounded history"""
+from __future__ import annotations
+
+import random
+from collections import deque
+
+HISTORY = 1000
+ROUNDS = 4
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+def _round(value: int, key: int) -> int:
+    """
+    Round function for the Feistel network.
+
+    :param value: The half block to mix.
+    :type value: int
+    :param key: The round key.
+    :type key: int
+    :return: A pseudo-random 64 bit value derived from value and key.
+    :rtype: int
+    """
+    value = ((value ^ key) * 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 29)) * 0xBF58476D1CE4E5B9) & MASK64
+    return value ^ (value >> 32)
+
+
+class Playlist(object):
+    """
+    Iterates over the indices of a list of `size` entries, either in order
+    or in a random order that does not repeat until every entry has been
+    played.  The random order is a keyed Feistel permutation of the
+    position in the lap, so nothing is materialized no matter how large the
+    list is.  Played entries are kept in a bounded history so `back()` and
+    `next()` can step through them in constant time.
+    """
+
+    def __init__(self, size: int, shuffle: bool = True,
+                 history: int = HISTORY, seed: int | None = None) -> None:
+        """
+        Initializes the playlist.
+
+        Public methods:
+        - next(): Returns the next entry.
+        - back(): Returns the previous entry from the history.
+
+        :param size: Number of entries to play.
+        :type size: int
+        :param shuffle: Play the entries in a random order.
+        :type shuffle: bool
+        :param history: Number of played entries to remember.
+        :type history: int
+        :param seed: Seed for the shuffle, for reproducible orders.
+        :type seed: int | None
+        """
+        self.size = size
+        self.shuffle = shuffle
+        bits = max(2, (size - 1).bit_length())
+        self.half = (bits + 1) // 2
+        self.mask = (1 << self.half) - 1
+        self.random = random.Random(seed)
+        self.keys: list[int] = []
+        self.position = 0
+        self.history: deque[int] = deque(maxlen=max(1, history))
+        self.offset = 0
+        self._new_lap()
+
+    def _new_lap(self) -> None:
+        """Starts a new pass over the entries with a fresh shuffle."""
+        self.position = 0
+        self.keys = [self.random.getrandbits(64) for _ in range(ROUNDS)]
+
+    def _permute(self, position: int) -> int:
+        """
+        Maps a position in the current lap to an entry.  The Feistel network
+        permutes the smallest even-bit domain covering `size`, and positions
+        that land outside the list are walked along their cycle until they
+        land inside it.
+
+        :param position: Position in the current lap.
+        :type position: int
+        :return: Index of the entry to play.
+        :rtype: int
+        """
+        if not self.shuffle:
+            return position
+        value = position
+        while True:
+            left, right = value >> self.half, value & self.mask
+            for key in self.keys:
+                left, right = right, left ^ (_round(right, key) & self.mask)
+            value = (left << self.half) | right
+            if value < self.size:
+                return value
+
+    def next(self) -> int:
+        """
+        Returns the next entry, replaying the history first if `back()` was
+        called.
+
+        :return: Index of the entry to play.
+        :rtype: int
+        """
+        if self.offset > 0:
+            self.offset -= 1
+            return self.history[-1 - self.offset]
+        if self.position == self.size:
+            self._new_lap()
+        index = self._permute(self.position)
+        self.position += 1
+        self.history.append(index)
+        return index
+
+    def back(self) -> int:
+        """
+        Returns the entry played before the current one, or the oldest entry
+        still in the history.
+
+        :return: Index of the entry to play.
+        :rtype: int
+        """
+        if self.offset < len(self.history) - 1:
+            self.offset += 1
+        return self.history[-1 - self.offset]
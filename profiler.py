@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Execution profiler and coverage report for scripts"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import time
+from types import GeneratorType
+from typing import Any, Callable, Generator, TextIO
+
+from media_index import MediaPool
+from script_parser import ANSWER, CALL, VOCAB, Parser, ShowMedia, \
+    WaitAnswer, load_program
+
+SCRIPT_EXTENSIONS = ('.md', '.txt')
+RUNS = 20
+MAX_STEPS = 10000
+JUNK = 'meh'
+
+
+class Profile(object):
+    """
+    Counters collected while scripts run under a `ProfiledParser`.
+
+    - lines: (script, index) -> [hits, seconds, vocab seconds]
+    - functions: name -> [calls, seconds]
+    - media: [samples, seconds]
+    - errors: script -> list of error messages
+    """
+
+    def __init__(self) -> None:
+        """Initializes empty counters."""
+        self.lines: dict[tuple[str, int], list] = {}
+        self.functions: dict[str, list] = {}
+        self.media = [0, 0.0]
+        self.runs: dict[str, int] = {}
+        self.errors: dict[str, list[str]] = {}
+
+    def line(self, script: str, index: int) -> list:
+        """Returns the counters of a line, creating them on first use."""
+        counters = self.lines.get((script, index))
+        if counters is None:
+            counters = self.lines[(script, index)] = [0, 0.0, 0.0]
+        return counters
+
+    def function(self, name: str, seconds: float, calls: int = 1) -> None:
+        """Adds time spent in a script function."""
+        counters = self.functions.setdefault(name, [0, 0.0])
+        counters[0] += calls
+        counters[1] += seconds
+
+
+class ProfiledParser(Parser):
+    """
+    A parser recording line hits and timings into a `Profile`.  Profiling
+    lives in this subclass so the plain `Parser` pays nothing for it.
+    """
+
+    __slots__ = ('profile', 'current', 'depth')
+
+    def __init__(self, script: str, profile: Profile, server=None) -> None:
+        """
+        Initializes the parser.
+
+        :param script: The script file to parse.
+        :type script: str
+        :param profile: The profile to record into.
+        :type profile: :class:`Profile`
+        :param server: An instance of the `Server` object.
+        :type server: :class:`Server`
+        """
+        super().__init__(script, server)
+        self.profile = profile
+        self.current = [0, 0.0, 0.0]
+        self.depth = 0
+
+    def _timed(self, name: str, script: Generator
+               ) -> Generator[Any, Any, Any]:
+        """Times every resumption of a script function's coroutine."""
+        reply = None
+        while True:
+            start = time.perf_counter()
+            try:
+                request = script.send(reply)
+            except StopIteration as stop:
+                self.profile.function(name, time.perf_counter() - start, 0)
+                if self.program.instructions[self.index][0] == ANSWER:
+                    self.profile.line(self.program.script, self.index)[0] += 1
+                return stop.value
+            self.profile.function(name, time.perf_counter() - start, 0)
+            reply = yield request
+
+    def execute(self, instruction: tuple) -> Any:
+        """
+        Executes an instruction, counting its line and timing it.  Commands
+        nested in a line, like the one `chance()` runs, are part of that
+        line and are neither counted nor timed separately.
+        """
+        if self.depth:
+            return super().execute(instruction)
+        self.current = self.profile.line(self.program.script, self.index)
+        self.current[0] += 1
+        start = time.perf_counter()
+        self.depth += 1
+        try:
+            result = super().execute(instruction)
+        finally:
+            self.depth -= 1
+        elapsed = time.perf_counter() - start
+        self.current[1] += elapsed
+        if instruction[0] == CALL:
+            self.profile.function(instruction[1], elapsed)
+            if isinstance(result, GeneratorType):
+                return self._timed(instruction[1], result)
+        return result
+
+    def _vocab(self, token: tuple) -> str:
+        """Expands a vocab token, timing the lookup."""
+        start = time.perf_counter()
+        word = Parser._vocab(self, token)
+        self.current[2] += time.perf_counter() - start
+        return word
+
+    expanders = dict(Parser.expanders, **{VOCAB: _vocab})
+
+
+def simulate(script: str, profile: Profile,
+             pools: dict[str, MediaPool] | None = None,
+             max_steps: int = MAX_STEPS) -> None:
+    """
+    Runs a script once without waiting, answering every question with one
+    of its accepted answers picked at random.
+
+    :param script: /path/to/script
+    :type script: str
+    :param profile: The profile to record into.
+    :type profile: :class:`Profile`
+    :param pools: Media pools to sample for showImage() calls.
+    :type pools: dict[str, MediaPool] | None
+    :param max_steps: Requests after which the run is abandoned.
+    :type max_steps: int
+    """
+    parser = ProfiledParser(script, profile)
+    run = parser.run()
+    profile.runs[script] = profile.runs.get(script, 0) + 1
+    reply = None
+    try:
+        for _ in range(max_steps):
+            request = run.send(reply)
+            reply = None
+            if isinstance(request, WaitAnswer):
+                options = [option for options, _ in
+                           parser.program.blocks.get(parser.index, ())
+                           for option in options]
+                reply = random.choice(options) if options else JUNK
+            elif isinstance(request, ShowMedia):
+                start = time.perf_counter()
+                pool = (pools or {}).get(request.pool.lower())
+                if pool is not None and pool.images:
+                    random.choice(pool.images)
+                profile.media[0] += 1
+                profile.media[1] += time.perf_counter() - start
+        profile.errors.setdefault(script, []).append(
+            'gave up after %d steps' % max_steps)
+    except StopIteration:
+        pass
+    except Exception as error:
+        profile.errors.setdefault(script, []).append(
+            'line %d: %s: %s' % (parser.index + 1, type(error).__name__,
+                                 error))
+
+
+def find_scripts(paths: list[str]) -> list[str]:
+    """
+    Expands folders into the scripts they contain.
+
+    :param paths: Scripts and folders of scripts.
+    :type paths: list[str]
+    :return: /path/to/script for every script found.
+    :rtype: list[str]
+    """
+    scripts = []
+    for path in paths:
+        if not os.path.isdir(path):
+            scripts.append(path)
+            continue
+        for root, folders, files in os.walk(path):
+            folders[:] = sorted(f for f in folders if not f.startswith('.'))
+            scripts.extend(os.path.join(root, file) for file in sorted(files)
+                           if file.endswith(SCRIPT_EXTENSIONS))
+    return scripts
+
+
+def report(profile: Profile, scripts: list[str], out: TextIO) -> None:
+    """
+    Writes a coverage and timing report.
+
+    :param profile: The recorded profile.
+    :type profile: :class:`Profile`
+    :param scripts: The scripts to report on.
+    :type scripts: list[str]
+    :param out: The stream to write to.
+    :type out: TextIO
+    """
+    write: Callable[[str], Any] = lambda text='': print(text, file=out)
+    for script in scripts:
+        program = load_program(script)
+        hit = [profile.lines.get((script, i), [0, 0.0, 0.0])
+               for i in range(len(program))]
+        covered = sum(1 for counters in hit if counters[0])
+        write('%s: %d runs, %d/%d lines covered (%.0f%%)' % (
+            script, profile.runs.get(script, 0), covered, len(program),
+            100.0 * covered / max(1, len(program))))
+        for error in sorted(set(profile.errors.get(script, []))):
+            write('  error: %s' % error)
+        write('  %5s %8s %10s %10s  %s' % ('line', 'hits', 'ms', 'vocab ms',
+                                           'source'))
+        for i, (hits, seconds, vocab) in enumerate(hit):
+            write('  %5d %8d %10.3f %10.3f  %s' % (
+                i + 1, hits, seconds * 1000, vocab * 1000,
+                program.lines[i].rstrip()))
+        write()
+    write('%-16s %8s %10s' % ('function', 'calls', 'ms'))
+    for name, (calls, seconds) in sorted(profile.functions.items(),
+                                         key=lambda item: -item[1][1]):
+        write('%-16s %8d %10.3f' % (name, calls, seconds * 1000))
+    vocab = sum(counters[2] for counters in profile.lines.values())
+    write()
+    write('vocab lookups: %.3f ms' % (vocab * 1000))
+    write('media samples: %d in %.3f ms' % (profile.media[0],
+                                            profile.media[1] * 1000))
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(
+        description='Simulate scripts and report line coverage and timings.')
+    parser.add_argument('paths', nargs='*', default=['Scripts'],
+                        help='scripts or folders of scripts')
+    parser.add_argument('-n', '--runs', type=int, default=RUNS,
+                        help='simulated runs per script')
+    parser.add_argument('-s', '--seed', type=int, default=None,
+                        help='random seed for reproducible runs')
+    parser.add_argument('-p', '--pool', action='append', default=[],
+                        metavar='NAME=FOLDER', help='media pool to sample')
+    parser.add_argument('-o', '--output', default=None,
+                        help='file to write the report to')
+    args = parser.parse_args(argv)
+    random.seed(args.seed)
+    pools = {}
+    for pool in args.pool:
+        name, folder = pool.split('=', 1)
+        pools[name.lower()] = MediaPool(name, folder)
+        pools[name.lower()].refresh()
+    profile = Profile()
+    scripts = find_scripts(args.paths)
+    for script in scripts:
+        for _ in range(args.runs):
+            simulate(script, profile, pools)
+    if args.output is None:
+        report(profile, scripts, sys.stdout)
+    else:
+        with open(args.output, 'w') as file:
+            report(profile, scripts, file)
+
+
+if __name__ == '__main__':
+    main()
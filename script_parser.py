@@ -2,20 +2,499 @@
 """Script parser for the AI domme"""
 from __future__ import annotations
 
-import re
+import hashlib
 import os
-import sqlite3
+import re
 import random
 import pickle
-from typing import Any
-
-DB = 'teaseai.db'
-
-
-class Parser():
-    """Script parser object"""
-
-    def __init__(self, script: str, server=None) -> None:
+from threading import Lock
+from types import GeneratorType, MappingProxyType
+from typing import Any, Generator, Mapping, NamedTuple
+
+from state_store import StateStore
+from vocabulary import Vocabulary, get_vocabulary
+
+CACHE_FOLDER = './.script_cache'
+COMPILER_VERSION = '2'
+
+SAY = 'say'
+CALL = 'call'
+ANCHOR = 'anchor'
+ANSWER = 'answer'
+
+VOCAB = 'vocab'
+VAR = 'var'
+RANDINT = 'randint'
+
+FUNCTIONS = ('getanswer', 'get_response', 'goto', 'chance', 'startstroking',
+             'stopstroking', 'setflag', 'getflag', 'loopanswer', 'edge',
+             'end', 'showimage', 'showbuttimage', 'showboobsimage', 'randint')
+QUESTIONS = ('getanswer', 'get_response')
+
+PAUSE = (0.5, 3.0)
+MEANINGLESS = '"Your response to my question seems meaningless."'
+
+
+class Say(NamedTuple):
+    """Request to send a line of dialog to chat."""
+    text: str
+
+
+class WaitTime(NamedTuple):
+    """Request to resume the script after a number of seconds."""
+    seconds: float
+
+
+class WaitAnswer(NamedTuple):
+    """
+    Request to resume the script with the user's next chat message, or with
+    None if no message arrives within `timeout` seconds.  `options` are the
+    accepted answers for clients that offer them as buttons.
+    """
+    timeout: float | None
+    options: tuple[str, ...] = ()
+
+
+class ShowMedia(NamedTuple):
+    """Request to show a random image from a named media pool."""
+    pool: str
+
+
+REQUESTS = (Say, WaitTime, WaitAnswer, ShowMedia)
+
+RX_ANCHOR = re.compile(r'^#\s+(.*)$')
+RX_ANSWER = re.compile(r'^\[(.*?)\]\s*(.*)$')
+RX_FUNCTION = re.compile(r'^\w+\(.*\)$')
+RX_STRING = re.compile(r'\".*\"')
+RX_WORD = re.compile(r"[\w']+")
+PHRASE = 3
+RX_TOKEN = re.compile(
+    r'(?P<%s>_.?\w*\s?\w*.?_)'
+    r'|(?P<%s>var\((?P<name>\w+_*\w*)\))'
+    r'|(?P<%s>randint\((?P<low>\d+), (?P<high>\d+)\))' % (VOCAB, VAR, RANDINT))
+
+
+def parse_function(function: str) -> tuple[str, list[str]]:
+    """
+    Parses a string identified by the parser as a regex match for a
+    function and returns a tuple containing the name of the function
+    and a list of arguments.
+
+    :param function: The string matching the regex for a function.
+    :type function: string
+    :return: A tuple containing the name of the function and a list of
+    arguments to be passed to the function.
+    :rtype: tuple
+    """
+    words = function.split('(', 1)
+    args = words[1][:-1].split(',', 1)
+    args = [arg.strip() for arg in args]
+    return (words[0], args)
+
+
+def tokenize(text: str) -> tuple:
+    """
+    Splits text into a template of literal strings and tokens that are
+    expanded each time the template is executed:
+    (VOCAB, word), (VAR, name) or (RANDINT, low, high).  The text is
+    scanned once with a single regex.
+
+    :param text: The text to split.
+    :type text: str
+    :return: The template.
+    :rtype: tuple
+    """
+    if '_' not in text and '(' not in text:
+        return (text,) if text else ()
+    segments: list = []
+    position = 0
+    for match in RX_TOKEN.finditer(text):
+        if match.start() > position:
+            segments.append(text[position:match.start()])
+        position = match.end()
+        kind = match.lastgroup
+        if kind == VOCAB:
+            segments.append((VOCAB, match.group().strip('_')))
+        elif kind == VAR:
+            segments.append((VAR, match.group('name')))
+        else:
+            segments.append((RANDINT, int(match.group('low')),
+                             int(match.group('high'))))
+    if position < len(text):
+        segments.append(text[position:])
+    return tuple(segments)
+
+
+def compile_line(line: str) -> tuple:
+    """
+    Compiles a line of a script into an instruction, one of:
+    - (SAY, dialog): Dialog to send to chat, None for lines with no dialog.
+    - (CALL, function, args): Call a script function with parsed args.
+    - (ANCHOR, name): A target for goto().
+    - (ANSWER, options, dialog): An accepted answer and optional dialog.
+
+    Dialog and args are templates, see `tokenize()`.
+
+    :param line: The line to compile.
+    :type line: str
+    :return: The instruction.
+    :rtype: tuple
+    """
+    line = line.strip()
+    match = RX_ANCHOR.match(line)
+    if match:
+        return (ANCHOR, match.group(1).strip())
+    match = RX_ANSWER.match(line)
+    if match:
+        options = tuple(option.strip() for option in
+                        match.group(1).split(','))
+        dialog = RX_STRING.search(match.group(2))
+        return (ANSWER, options, tokenize(dialog.group()) if dialog else None)
+    if RX_FUNCTION.match(line):
+        function, args = parse_function(line)
+        return (CALL, function.lower(), tuple(tokenize(arg) for arg in args))
+    match = RX_STRING.search(line)
+    return (SAY, tokenize(match.group()) if match else None)
+
+
+def compile_script(lines: list[str]) -> list[tuple]:
+    """
+    Compiles the lines of a script into a list of instructions, one per
+    line.
+
+    :param lines: The lines of the script.
+    :type lines: list[str]
+    :return: The instructions.
+    :rtype: list[tuple]
+    """
+    return [compile_line(line) for line in lines]
+
+
+def link(program: list[tuple]) -> tuple[dict[str, int], dict[int, tuple],
+                                        dict[int, int]]:
+    """
+    Resolves the jump targets of a compiled script once, so jumps and
+    answer lookups don't have to scan the script.
+
+    Returns three tables:
+    - anchors: Index of each anchor by lowercase name.  If a name is used
+      twice the first anchor wins.
+    - blocks: For each question and each anchor, the answers that follow
+      it up to the next anchor, as (options, index of the answer) tuples.
+    - loops: For each loopAnswer() call, the index of the question asked
+      before it.
+
+    :param program: The compiled script.
+    :type program: list[tuple]
+    :return: The anchors, blocks and loops tables.
+    :rtype: tuple[dict[str, int], dict[int, tuple], dict[int, int]]
+    """
+    anchors: dict[str, int] = {}
+    blocks: dict[int, tuple] = {}
+    loops: dict[int, int] = {}
+    owners: list[int] = []
+    answers: list[tuple] = []
+    question = -1
+    for i, instruction in enumerate(program + [(ANCHOR, None)]):
+        if instruction[0] == ANCHOR:
+            for owner in owners:
+                blocks[owner] = tuple(answer for answer in answers
+                                      if answer[1] > owner)
+            owners, answers = [i], []
+            if instruction[1] is not None:
+                anchors.setdefault(instruction[1].lower(), i)
+        elif instruction[0] == ANSWER:
+            answers.append((instruction[1], i))
+        elif instruction[0] == CALL and instruction[1] in QUESTIONS:
+            owners.append(i)
+            question = i
+        elif instruction[0] == CALL and instruction[1] == 'loopanswer':
+            loops[i] = question
+    return anchors, blocks, loops
+
+
+def read_script(source: str) -> list[str]:
+    """
+    Splits the source of a script into lines, dropping blank lines, indented
+    lines and the @Info line.
+
+    :param source: The text of the script.
+    :type source: str
+    :return: A list of lines.
+    :rtype: list[str]
+    """
+    regex = re.compile(r'^@|^\s')
+    return [line for line in source.splitlines(keepends=True)
+            if not regex.search(line)]
+
+
+def load_script(script: str, cache: str | None = CACHE_FOLDER) -> tuple:
+    """
+    Loads a compiled script.  Compiled scripts are pickled into the cache
+    folder under the SHA-256 of the compiler version and the script's
+    source, so an edited script or a change to the compiler never picks up
+    a stale artifact.
+
+    :param script: /path/to/script
+    :type script: str
+    :param cache: /path/to/folder for compiled scripts, None to disable\
+        the cache.
+    :type cache: str | None
+    :return: The lines, program, anchors, blocks and loops of the script.
+    :rtype: tuple
+    """
+    with open(script, 'rb') as file:
+        source = file.read()
+    key = hashlib.sha256(COMPILER_VERSION.encode() + b'\0' + source)
+    path = os.path.join(cache, key.hexdigest()) if cache else None
+    if path is not None:
+        try:
+            with open(path, 'rb') as file:
+                return pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+    lines = read_script(source.decode())
+    program = compile_script(lines)
+    compiled = (lines, program, *link(program))
+    if path is not None:
+        try:
+            os.makedirs(cache, exist_ok=True)
+            with open(path + '.tmp', 'wb') as file:
+                pickle.dump(compiled, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+    return compiled
+
+
+def fold(text: str) -> list[str]:
+    """
+    Folds text for answer matching into casefolded words without
+    punctuation.
+
+    :param text: The text to fold.
+    :type text: str
+    :return: The folded words.
+    :rtype: list[str]
+    """
+    return RX_WORD.findall(text.casefold())
+
+
+class AnswerIndex(object):
+    """
+    The answer blocks of a program compiled into one dictionary per
+    question, mapping each phrasing to its answer, so matching input is a
+    dictionary probe however many phrasings a block accepts.  Phrasings are
+    folded and keyed both word by word and as a whole through the
+    vocabulary, so synonyms of single words and of phrases like "no way"
+    match too.
+    """
+
+    __slots__ = ('version', 'phrases', 'longest')
+
+    def __init__(self, blocks: Mapping[int, tuple],
+                 vocabulary: Vocabulary) -> None:
+        """
+        Builds the index.  The first answer of a block listing a phrasing
+        wins.
+
+        :param blocks: The blocks table from `link()`.
+        :type blocks: Mapping[int, tuple]
+        :param vocabulary: The vocabulary to resolve synonyms with.
+        :type vocabulary: :class:`Vocabulary`
+        """
+        self.version = vocabulary.version()
+        self.phrases: dict[int, dict[str, int]] = {}
+        self.longest = PHRASE
+        for owner, answers in blocks.items():
+            table: dict[str, int] = {}
+            for options, target in answers:
+                for option in options:
+                    words = fold(option)
+                    if words:
+                        for key in self._keys(words, vocabulary):
+                            table.setdefault(key, target)
+                        self.longest = max(self.longest, len(words))
+            self.phrases[owner] = table
+
+    @staticmethod
+    def _keys(words: list[str], vocabulary: Vocabulary) -> tuple[str, str]:
+        """Returns the word by word and whole phrase keys of folded words."""
+        return (' '.join(vocabulary.canonical(word) for word in words),
+                vocabulary.canonical(' '.join(words)))
+
+    def match(self, owner: int, text: str,
+              vocabulary: Vocabulary) -> int | None:
+        """
+        Finds the answer matching the user's input: the whole input if it
+        is an accepted phrasing, else the longest accepted phrasing found in
+        it, leftmost first.
+
+        :param owner: Index of the question or anchor owning the answers.
+        :type owner: int
+        :param text: The user's input.
+        :type text: str
+        :param vocabulary: The vocabulary to resolve synonyms with.
+        :type vocabulary: :class:`Vocabulary`
+        :return: Index of the matching answer, or None.
+        :rtype: int | None
+        """
+        table = self.phrases.get(owner)
+        if not table:
+            return None
+        words = fold(text)
+        for size in range(min(self.longest, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                for key in self._keys(words[start:start + size], vocabulary):
+                    target = table.get(key)
+                    if target is not None:
+                        return target
+        return None
+
+
+class Program(object):
+    """
+    A compiled script.  Programs are read-only and shared by every session
+    running the script, see `load_program()`.  The answer index is built on
+    first use, see `answers()`.
+    """
+
+    __slots__ = ('script', 'stamp', 'lines', 'instructions', 'anchors',
+                 'blocks', 'loops', 'index')
+
+    script: str
+    stamp: tuple[int, int]
+    lines: tuple[str, ...]
+    instructions: tuple[tuple, ...]
+    anchors: Mapping[str, int]
+    blocks: Mapping[int, tuple]
+    loops: Mapping[int, int]
+    index: AnswerIndex | None
+
+    def __init__(self, script: str, stamp: tuple[int, int],
+                 compiled: tuple) -> None:
+        """
+        Wraps the output of `load_script()`.
+
+        :param script: /path/to/script
+        :type script: str
+        :param stamp: The script's modification time and size when loaded.
+        :type stamp: tuple[int, int]
+        :param compiled: The lines, program, anchors, blocks and loops.
+        :type compiled: tuple
+        """
+        lines, program, anchors, blocks, loops = compiled
+        for name, value in (('script', script), ('stamp', stamp),
+                            ('lines', tuple(lines)),
+                            ('instructions', tuple(program)),
+                            ('anchors', MappingProxyType(anchors)),
+                            ('blocks', MappingProxyType(blocks)),
+                            ('loops', MappingProxyType(loops)),
+                            ('index', None)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError('Program is read-only')
+
+    def __len__(self) -> int:
+        return len(self.instructions)
+
+    def answers(self, vocabulary: Vocabulary) -> AnswerIndex:
+        """
+        Returns the answer index of the program, building it on first use and
+        again whenever the vocabulary changes.
+
+        :param vocabulary: The vocabulary to resolve synonyms with.
+        :type vocabulary: :class:`Vocabulary`
+        :return: The answer index.
+        :rtype: :class:`AnswerIndex`
+        """
+        index = self.index
+        if index is None or index.version != vocabulary.version():
+            index = AnswerIndex(self.blocks, vocabulary)
+            object.__setattr__(self, 'index', index)
+        return index
+
+
+_programs: dict[str, Program] = {}
+_programs_lock = Lock()
+
+
+def load_program(script: str) -> Program:
+    """
+    Returns the compiled program for a script, shared across the process.
+    The script is compiled again if it changed since it was last loaded.
+
+    :param script: /path/to/script
+    :type script: str
+    :return: The shared program.
+    :rtype: :class:`Program`
+    """
+    path = os.path.abspath(script)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _programs_lock:
+        program = _programs.get(path)
+        if program is None or program.stamp != stamp:
+            program = _programs[path] = Program(script, stamp,
+                                                load_script(script))
+        return program
+
+
+def loaded_program(script: str) -> Program | None:
+    """
+    Returns the program last loaded for a script without checking the file.
+
+    :param script: /path/to/script
+    :type script: str
+    :return: The shared program, or None if the script was never loaded.
+    :rtype: :class:`Program` | None
+    """
+    return _programs.get(os.path.abspath(script))
+
+
+def relocate(old: Program, new: Program, index: int) -> int | None:
+    """
+    Maps a position in a program to the same position in an edited version
+    of it.  A position can be carried over if the lines from the anchor
+    before it (or the start of the script) up to it are unchanged.
+
+    :param old: The program the position is in.
+    :type old: :class:`Program`
+    :param new: The edited program.
+    :type new: :class:`Program`
+    :param index: The position in the old program.
+    :type index: int
+    :return: The position in the new program, or None.
+    :rtype: int | None
+    """
+    start = index
+    while start >= 0 and old.instructions[start][0] != ANCHOR:
+        start -= 1
+    if start < 0:
+        target = -1
+    else:
+        target = new.anchors.get(old.instructions[start][1].lower())
+        if target is None or new.instructions[target] != \
+                old.instructions[start]:
+            return None
+    offset = index - start
+    if old.instructions[start + 1:index + 1] != \
+            new.instructions[target + 1:target + offset + 1]:
+        return None
+    return target + offset
+
+
+class Parser(object):
+    """
+    Runs a script for one session.  The parser only holds the session's
+    position and state; the compiled script is a shared `Program`.
+    """
+
+    __slots__ = ('server', 'program', 'index', 'stroking', 'user', 'state')
+
+    def __init__(self, script: str, server=None, user: str = '',
+                 state: StateStore | None = None) -> None:
         """
         Initializes the parser.
 
@@ -23,150 +502,125 @@ class Parser():
         :type script: file
         :param server: An instance of the `Server` object.
         :type server: :class:`Server`
+        :param user: The user the script runs for.
+        :type user: str
+        :param state: The store of flags and variables, defaults to one\
+            kept in memory only.
+        :type state: :class:`StateStore` | None
         """
         self.server = server
-        self.script = script
-        self.conn = sqlite3.connect(DB)
-        self.lines = self.read()
+        self.user = user
+        self.state = state if state is not None else StateStore(None)
+        self.program = load_program(script)
         self.index = -1
-        self.rx_dict = {
-            'function': re.compile(r'\S+\(.*\)'),
-            'option': re.compile(r'^\[.*\]'),
-            'anchor': re.compile(r'^#\s.*\n'),
-            'string': re.compile(r'\".*\"'),
-        }
         self.stroking = False
 
     def _get_synonym(self, vocab: str) -> str:
         """
-        Retrieves a list of synonyms for the given vocab word from the
-        database and returns a randomly selected synonym.
+        Draws a random synonym for the given vocab word from the shared
+        vocabulary.
 
         :param vocab: The vocab string from the parser.
         :type vocab: :type:`str`
         :return: A randomly selected synonym.
         :rtype: string
         """
-        con = sqlite3.connect(DB)
         vocab = vocab.strip('_') if vocab.startswith('_') else vocab
-        sql = 'WITH const as (SELECT SynID FROM vocab WHERE word = "%s"), \
-               const2 as (SELECT SynID from synonyms where ParentSynID \
-               in (SELECT * from const) UNION SELECT ParentSynID from \
-               synonyms where SynID in (SELECT * from const)) SELECT word \
-               from vocab WHERE SynID in const2' % vocab
-        res = [line[0] for line in con.execute(sql)]
-        res.append(vocab)
-        return res[random.randint(0, len(res) - 1)]
-
-    def read(self) -> list[str]:
-        """
-        Reads the current script file into memory, strips blank lines and
-        the @Info line and parses all the vocab strings.  Returns a list
-        of lines.
-
-        :return: A list of lines.
-        :rtype: list of strings
-        """
-        with open(self.script, 'r') as file:
-            lines = file.readlines()
-            regex = re.compile(r'^@|^\s')
-            lines = [line for line in lines if not regex.search(line)]
-            regex = re.compile(r'_.?\w*\s?\w*.?_')
-            for i, line in enumerate(lines):
-                for hit in regex.findall(line):
-                    lines[i] = lines[i].replace(hit, self._get_synonym(hit))
-            regex = re.compile(r'var\(\w+_*\w*\)')
-            for i, line in enumerate(lines):
-                for hit in regex.findall(line):
-                    args = self._parse_function(hit)[1]
-                    # TODO: resolve this to a specific user
-                    lines[i] = lines[i].replace(hit, args[0])
-            regex = re.compile(r'randint\(\d+, \d+\)')
-            for i, line in enumerate(lines):
-                for hit in regex.findall(line):
-                    args = self._parse_function(hit)[1]
-                    lines[i] = lines[i].replace(
-                        hit, str(random.randint(int(args[0]), int(args[1]))))
-        return lines
-
-    def _parse_function(self, function: str):
-        """
-        Parses a string identified by the parser as a regex match for a
-        function and returns a tuple containing the name of the function
-        and a list of arguments.
-
-        :param function: The string matching the regex for a function.
-        :type function: string
-        :return: A tuple containing the name of the function and a list of
-        arguments to be passed to the function.
-        :rtype: tuple
-        """
-        words = function.split('(', 1)
-        args = words[1][:-1].split(',', 1)
-        args = [arg.strip() for arg in args]
-        return (words[0], args)
-
-    def getanswer(self, args: list[str]) -> str:
-        """
-        Gets an answer to a question from the client and returns\
-            the AI's response
+        return get_vocabulary().synonym(vocab)
+
+    def _vocab(self, token: tuple) -> str:
+        """Expands a vocab token to a random synonym."""
+        return get_vocabulary().synonym(token[1])
+
+    def _var(self, token: tuple) -> str:
+        """Expands a var() token to the user's value, or its name if unset."""
+        value = self.state.get(self.user, 'var:' + token[1])
+        return token[1] if value is None else str(value)
+
+    def _randint(self, token: tuple) -> str:
+        """Expands a randint() token to a random number."""
+        return str(random.randint(token[1], token[2]))
+
+    def expand(self, template: tuple | None) -> str | None:
+        """
+        Expands a template, drawing fresh synonyms and random numbers.
+
+        :param template: The template to expand.
+        :type template: tuple | None
+        :return: The expanded text.
+        :rtype: str | None
+        """
+        if template is None:
+            return None
+        return ''.join(segment if isinstance(segment, str) else
+                       self.expanders[segment[0]](self, segment)
+                       for segment in template)
+
+    def _match(self, question: int, answer: str) -> int | None:
+        """
+        Finds the answer to a question that matches the user's input.
+
+        :param question: Index of the question or anchor owning the answers.
+        :type question: int
+        :param answer: The user's input.
+        :type answer: str
+        :return: Index of the matching answer, or None.
+        :rtype: int | None
+        """
+        vocabulary = get_vocabulary()
+        return self.program.answers(vocabulary).match(question, answer,
+                                                      vocabulary)
+
+    def _ask(self, args: list[str], options: tuple[str, ...] = ()
+             ) -> Generator[Any, str | None, str | None]:
+        """
+        Waits for an answer to the question at the current position and
+        jumps to the matching answer, returning its dialog if it has any.
+        Unmatched answers are rejected and the user is asked again.
+
+        :param args: Seconds to wait before prompting again, and the prompt.
+        :type args: list[str]
+        :param options: The accepted answers to offer the user.
+        :type options: tuple[str, ...]
+        """
+        timeout = float(args[0]) if args and args[0] else None
+        prompt = args[1] if len(args) > 1 and args[1] else None
+        question = self.index
+        while True:
+            answer = yield WaitAnswer(timeout, options)
+            if answer is None:
+                if prompt is not None:
+                    yield Say('"%s"' % prompt)
+                continue
+            target = self._match(question, answer)
+            if target is not None:
+                self.index = target
+                return self.expand(self.program.instructions[target][2])
+            yield Say(MEANINGLESS)
+
+    def getanswer(self, args: list[str]
+                  ) -> Generator[Any, str | None, str | None]:
+        """
+        Gets an answer to a question from the client and jumps to the
+        matching answer, returning its dialog if it has any.
 
         :param args: A list of arguments to be passed to the function.
         :type args: list[str]
         """
-        options = []
-        # TODO: prompt user after timeout
-        # TODO: get input from the chat
-        # TODO: resolve options to vocab words
-        lines = self.lines[self.index:]
-        for i, line in enumerate(lines):
-            match = re.match(self.rx_dict['option'], line)
-            if match:
-                line = line.lstrip('[').rstrip(']  \n')
-                options.append(line.split(', '))
-                options.append(lines[i + 1].rstrip('  \n'))
-                options.append(i + 1)
-            match = re.match(self.rx_dict['anchor'], line)
-            if match:
-                break
-        user_input = 'yes'
-        for i, option in enumerate(options):
-            if type(option) == list and user_input in option:
-                self.index += options[i+2]
-                return options[i+1]
-        self.index -= 2
-        return '"Your response to my question seems meaningless."'
-
-    def get_response(self, args: list[str]) -> str:
-        """
-        Gets an answer to a question from the client and returns\
-            the AI's response
+        return self._ask(args)
+
+    def get_response(self, args: list[str]
+                     ) -> Generator[Any, str | None, str | None]:
+        """
+        Offers the accepted answers to the client as choices, then gets an
+        answer like `getanswer()`.
 
         :param args: A list of arguments to be passed to the function.
         :type args: list[str]
         """
-        options = []
-        # TODO: prompt user after timeout
-        # TODO: get input from the chat
-        # TODO: resolve options to vocab words
-        lines = self.lines[self.index:]
-        for i, line in enumerate(lines):
-            match = re.match(self.rx_dict['option'], line)
-            if match:
-                options.append((i, line.lstrip('[').rstrip(']  \n')))
-            match = re.match(self.rx_dict['anchor'], line)
-            if match:
-                break
-        # - Update the clients with the list of possible responses so they can
-        #   update the GUI, and enter a while loop until some variable gets
-        #   populated.
-        options = pickle.dumps(options).decode()
-        self.server.broadcast(options)
-        # - User clicks a response button, client receives response data
-        #   and sends it to the server.
-        # - The server populates the variable we are polling.
-        # - Our while loop breaks and we handle the user's response data.
-        return '"Your response to my question seems meaningless."'
+        options = tuple(', '.join(answer) for answer, _ in
+                        self.program.blocks.get(self.index, ()))
+        return self._ask(args, options)
 
     def goto(self, args: list[str]) -> None:
         """
@@ -175,10 +629,7 @@ class Parser():
         :param args: A list of arguments for the function.
         :type args: list[str]
         """
-        anchor = args[0]
-        for i, line in enumerate(self.lines):
-            if anchor in line and line.startswith('#'):
-                self.index = i
+        self.index = self.program.anchors.get(args[0].lower(), self.index)
 
     def chance(self, args: list[str]) -> None:
         """
@@ -190,7 +641,8 @@ class Parser():
         chance = args[0]
         command = args[1]
         if random.randint(0, 100) <= int(chance):
-            self.parse(command.strip('\''))
+            return self.parse(command.strip('\''))
+        return None
 
     def startstroking(self, args: list[str]) -> str:
         """
@@ -214,35 +666,37 @@ class Parser():
 
     def setflag(self, args: list[str]) -> None:
         """
-        Jumps to a different position in the script.
+        Sets a flag for the user, kept across sessions.
 
         :param args: A list of arguments for the function.
         :type args: list[str]
         """
-        OPTIONS[args[0]] = True
+        self.state.set(self.user, 'flag:' + args[0], True)
 
     def getflag(self, args: list[str]) -> None:
         """
-        Jumps to a different position in the script.
+        Jumps to the anchor named after a flag if the user has it set.
 
         :param args: A list of arguments for the function.
         :type args: list[str]
         """
-        keys = OPTIONS.dict.keys()
-        if args[0] in keys and OPTIONS[args[0]]:
+        if self.state.get(self.user, 'flag:' + args[0]):
             self.goto([args[0]])
 
-    def loopanswer(self, args: list[str]) -> str:
+    def loopanswer(self, args: list[str]
+                   ) -> Generator[Any, str | None, str | None]:
         """
-        Jumps to a different position in the script.
+        Asks the last question again, or the answers following an anchor if
+        one is given.
 
         :param args: A list of arguments for the function.
         :type args: list[str]
         """
-        for i, line in enumerate(self.lines):
-            if args[0] in line and line.startswith('#'):
-                self.index = i + 1
-        return self.getanswer([])
+        if args[0]:
+            self.goto(args)
+        else:
+            self.index = self.program.loops.get(self.index, self.index)
+        return self._ask([])
 
     def edge(self, args: list[str]):
         """
@@ -261,9 +715,19 @@ class Parser():
         :type args: list[str]
         """
         # TODO: pick up the next script
-        exit()
+        self.index = len(self.program)
+
+    def showimage(self, args: list[str]) -> ShowMedia:
+        """
+        Randomly selects an image from the named media pool and displays it
+        in the client.
+
+        :param args: A list of arguments for the function.
+        :type args: list[str]
+        """
+        return ShowMedia(args[0])
 
-    def showbuttimage(self, args: list[str]) -> None:
+    def showbuttimage(self, args: list[str]) -> ShowMedia:
         """
         Randomly selects an image from the user's selected "butts" directory
         and displays it in the client.
@@ -271,27 +735,17 @@ class Parser():
         :param args: A list of arguments for the function.
         :type args: list[str]
         """
-        folder = OPTIONS['BUTTS_FOLDER']
-        images = [os.path.join(folder, f) for f in sorted(os.listdir(folder))
-                  if os.path.isfile(os.path.join(folder, f)) and f.lower(
-                  ).endswith(('png', 'jpg', 'jpeg', 'tiff', 'bmp'))]
-        image = images[random.randint(0, len(images) - 1)]
-        self.server.broadcast_image(image)
+        return self.showimage(['butts'])
 
-    def showboobsimage(self, args: list[str]) -> None:
+    def showboobsimage(self, args: list[str]) -> ShowMedia:
         """
-        Randomly selects an image from the user's selected "butts" directory
+        Randomly selects an image from the user's selected "boobs" directory
         and displays it in the client.
 
         :param args: A list of arguments for the function.
         :type args: list[str]
         """
-        folder = OPTIONS['BOOBS_FOLDER']
-        images = [os.path.join(folder, f) for f in sorted(os.listdir(folder))
-                  if os.path.isfile(os.path.join(folder, f)) and f.lower(
-                  ).endswith(('png', 'jpg', 'jpeg', 'tiff', 'bmp'))]
-        image = images[random.randint(0, len(images) - 1)]
-        self.server.broadcast_image(image)
+        return self.showimage(['boobs'])
 
     def randint(self, args: list[str]) -> int:
         """
@@ -302,6 +756,78 @@ class Parser():
         """
         return random.randint(int(args[0]), int(args[1]))
 
+    def _say(self, instruction: tuple) -> str | None:
+        """Executes a SAY instruction."""
+        return self.expand(instruction[1])
+
+    def _call(self, instruction: tuple) -> Any:
+        """Executes a CALL instruction."""
+        function = self.functions.get(instruction[1])
+        if function is None:
+            raise ValueError('Unknown script function: %s' % instruction[1])
+        return function(self, [self.expand(arg) for arg in instruction[2]])
+
+    def _anchor(self, instruction: tuple) -> None:
+        """Executes an ANCHOR instruction."""
+        return None
+
+    def _answer(self, instruction: tuple) -> str | None:
+        """Executes an ANSWER instruction."""
+        return self.expand(instruction[2])
+
+    def execute(self, instruction: tuple) -> Any:
+        """
+        Executes a compiled instruction.  Returns output if any is necessary.
+
+        :param instruction: The instruction to execute.
+        :type instruction: tuple
+        :return: String to output to chat.
+        :rtype: str|None
+        """
+        return self.handlers[instruction[0]](self, instruction)
+
+    def reload(self) -> bool:
+        """
+        Switches to the latest compiled version of the script if it was
+        edited and the current position still exists in it.  Only call this
+        while the script is suspended between lines, not while it waits for
+        an answer.
+
+        :return: True if the parser switched programs.
+        :rtype: bool
+        """
+        program = loaded_program(self.program.script)
+        if program is None or program is self.program:
+            return False
+        index = relocate(self.program, program, self.index)
+        if index is None:
+            return False
+        self.program, self.index = program, index
+        return True
+
+    def run(self) -> Generator[Any, Any, None]:
+        """
+        Runs the script from the current position as a coroutine.  Instead of
+        blocking, the script yields requests (`Say`, `WaitTime`,
+        `WaitAnswer`, `ShowMedia`) for the caller to carry out, and is
+        resumed with `send()` once they are done, with the user's answer
+        (or None on timeout) for `WaitAnswer`.
+
+        :return: A generator of requests.
+        :rtype: Generator
+        """
+        while self.index < len(self.program) - 1:
+            self.index += 1
+            result = self.execute(self.program.instructions[self.index])
+            if isinstance(result, GeneratorType):
+                result = yield from result
+            elif isinstance(result, REQUESTS):
+                yield result
+                continue
+            if isinstance(result, str) and result:
+                yield Say(result)
+                yield WaitTime(random.uniform(*PAUSE))
+
     def parse(self, line: str) -> Any:
         """
         Parses a line of a script.  Returns output if any is necessary.
@@ -312,43 +838,28 @@ class Parser():
         :return: String to output to chat.
         :rtype: str|None
         """
-        for key, rx in self.rx_dict.items():
-            match = rx.findall(line)
-            for item in match:
-                if key == 'function':
-                    func, args = self._parse_function(match[0])
-                    return eval('self.%s(%s)' % (func.lower(), args))
-                elif key == 'string':
-                    return item.strip()
+        return self.execute(compile_line(line))
 
+    handlers = {SAY: _say, CALL: _call, ANCHOR: _anchor, ANSWER: _answer}
+    expanders = {VOCAB: _vocab, VAR: _var, RANDINT: _randint}
 
-if __name__ == '__main__':
 
-    def syn(terms: list) -> None:
-        """
-        Takes a list of indeces for vocab words and adds the synonym\
-        crossreferences to the database.
-
-        :param terms: The list of indeces of synonyms in the vocab table.
-        :type terms: list
-        """
-        conn = sqlite3.connect(DB)
-        junk = []
-        for term in terms:
-            tuples = [(term, x) for x in terms if x != term]
-            for x in tuples:
-                junk.append(x) if (x[1], x[0]) not in junk else ...
-
-        for x in junk:
-            conn.execute('INSERT INTO synonyms(ParentSynID, SynID) \
-                            VALUES(?, ?)', (x[0], x[1]))
-        conn.commit()
-
-    from server import Server
-    server = Server()
-    parser = Parser('Scripts/Module/AssOrTitsMan_EDGING.txt', server)
-    while parser.index <= len(parser.lines) - 2:
-        parser.index += 1
-        line = parser.parse(parser.lines[parser.index])
-        if line and line.startswith('"'):
-            print(line)
+Parser.functions = {name: getattr(Parser, name) for name in FUNCTIONS}
+
+
+if __name__ == '__main__':
+    parser = Parser('Scripts/Module/AssOrTitsMan_EDGING.txt')
+    script = parser.run()
+    reply = None
+    while True:
+        try:
+            request = script.send(reply)
+        except StopIteration:
+            break
+        reply = None
+        if isinstance(request, Say):
+            print(request.text)
+        elif isinstance(request, WaitAnswer):
+            reply = input('> ')
+        elif isinstance(request, ShowMedia):
+            print('[%s]' % request.pool)
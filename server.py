@@ -2,22 +2,35 @@
 """Classes related to the TeaseAI server"""
 from __future__ import annotations
 
+import heapq
+import json
 import os
 import pickle
-import random
 import socket
 import sqlite3
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
 from queue import SimpleQueue
-from threading import Lock, Thread
-from typing import Any
+from threading import Condition, Lock, Thread
+from typing import Any, Callable
 
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.serialization import Encoding,\
     PublicFormat, load_pem_public_key
 
-from crypto_functions import get_key_pair, hash_password, \
+from catalog import Catalog
+from chat_log import ChatLog, pack
+from crypto_functions import get_image, get_key_pair, hash_password, \
     send_package, open_package
-from script_parser import Parser
+from image_cache import digest
+from media_index import MediaIndex
+from migrations import migrate
+from playlist import Playlist
+from script_parser import Parser, Say, ShowMedia, WaitAnswer, WaitTime, \
+    load_program, loaded_program
+from state_store import StateStore
+from thumbnails import get_thumbnails, pack_thumbnails
 
 DB = 'teaseai.db'
 
@@ -25,6 +38,80 @@ conn = sqlite3.connect(DB)
 
 BUFFER = 512
 
+PREFETCH = 3
+INTERVAL = 3.0
+BLOBS = 64
+PAGE = 500
+LISTINGS = 16
+START_SCRIPT = './Scripts/Start/HappyToSeeMe.md'
+WATCH = 2.0
+
+
+def read_listing_request(msg: bytes) -> dict[str, Any] | None:
+    """
+    Decodes a client's request for a folder listing.  Requests are JSON so
+    reading one can never run code on the server.
+
+    :param msg: The request as sent by the client.
+    :type msg: bytes
+    :return: The request, or None if it is malformed.
+    :rtype: dict[str, Any] | None
+    """
+    try:
+        request = json.loads(msg.decode())
+    except ValueError:
+        return None
+    if not isinstance(request, dict) or \
+            not isinstance(request.get('path'), str):
+        return None
+    kinds = {'cursor': list, 'limit': int, 'pages': int, 'ext': list,
+             'prefix': str}
+    for key, kind in kinds.items():
+        if request.get(key) is not None and \
+                not isinstance(request[key], kind):
+            return None
+    cursor = request.get('cursor')
+    if cursor is not None and not (
+            len(cursor) == 3 and isinstance(cursor[0], bool) and
+            all(isinstance(part, str) for part in cursor[1:])):
+        return None
+    if not all(isinstance(ext, str) for ext in request.get('ext') or ()):
+        return None
+    if request.get('limit') is not None and request['limit'] < 1:
+        return None
+    return request
+
+
+def read_listing_page(msg: bytes) -> dict[str, Any] | None:
+    """
+    Decodes a page of a folder listing sent by the server, the client side
+    counterpart of `read_listing_request()`.
+
+    :param msg: The page as sent by the server.
+    :type msg: bytes
+    :return: The page, or None if it is malformed.
+    :rtype: dict[str, Any] | None
+    """
+    try:
+        page = json.loads(msg.decode())
+    except ValueError:
+        return None
+    if not isinstance(page, dict) or \
+            not isinstance(page.get('path'), str) or \
+            not isinstance(page.get('total'), int):
+        return None
+    for key in ('folders', 'files'):
+        if not isinstance(page.get(key), list) or \
+                not all(isinstance(name, str) for name in page[key]):
+            return None
+    cursor = page.get('cursor')
+    if cursor is not None and not (
+            isinstance(cursor, list) and len(cursor) == 3 and
+            isinstance(cursor[0], bool) and
+            all(isinstance(part, str) for part in cursor[1:])):
+        return None
+    return page
+
 
 class Person:
     """Class to hold data about connected clients"""
@@ -44,9 +131,11 @@ class Person:
         self.addr = addr
         self.socket = client
         self.name: str = ''
+        self.username: str = ''
         self.key = key
         self.ops = False
         self.options = {}
+        self.send_lock = Lock()
 
 
 class Server(object):
@@ -67,6 +156,9 @@ class Server(object):
         - broadcast_image(): Displays an image to all connected clients.
         """
 
+        migrate(DB)
+        self.state = StateStore(DB)
+        self.chat = ChatLog(DB)
         self.host = self.opt_get('hostname')
         self.port = int(self.opt_get('port'))
         self.address = (self.host, self.port)
@@ -78,6 +170,12 @@ class Server(object):
         self.client_lock = Lock()
         self.queue = SimpleQueue()
         self.queue.put('Not Started.')
+        self.blobs: OrderedDict[str, bytes] = OrderedDict()
+        self.blob_lock = Lock()
+        self.thumbnails = get_thumbnails()
+        self.listings: OrderedDict[str, tuple[int, list]] = OrderedDict()
+        self.listing_lock = Lock()
+        self.media = MediaIndex(self)
         self.slideshow = SlideShow(self.path, self)
         self.ai = AI(self)
 
@@ -109,6 +207,9 @@ class Server(object):
             self.started = False
             self.socket.shutdown(socket.SHUT_RDWR)
             self.socket.close()
+            self.thumbnails.close()
+            self.state.close()
+            self.chat.close()
             self.queue.put("Shut down.")
 
     def update(self):
@@ -156,8 +257,9 @@ class Server(object):
         :param name: The name of the sender of the message
         :type name: str
         """
+        txt = '%s %s' % (name, msg)
+        self.chat.append(txt)
         for person in self.clients:
-            txt = '%s %s' % (name, msg)
             try:
                 self.send_message(person, txt, 'MSG')
             except socket.error as error:
@@ -220,6 +322,7 @@ class Server(object):
                 username, password = self._validate_auth_packet(auth_packet,
                                                                 person)
         con.close()
+        person.username = username
         return True
 
     def _login(self, person: Person) -> bool:
@@ -244,6 +347,7 @@ class Server(object):
         else:
             person.name = person.options['CHAT_NAME']
         msg = ('%s has joined the chat!' % person.name.lstrip('@'))
+        self.send_message(person, pack(self.chat.recent()), 'HIS')
         with self.client_lock:
             self.clients.append(person)
             self.broadcast(msg, "")
@@ -251,6 +355,8 @@ class Server(object):
                 msg = ('Server sets mode +o %s' % person.name.lstrip('@'))
                 self.broadcast(msg, "")
                 self._send_session_vars()
+        self.slideshow.replay(person)
+        self.ai.start(person)
         return True
 
     def _send_session_vars(self) -> None:
@@ -275,12 +381,13 @@ class Server(object):
         :type person: :class:`Person`
         :param msg: Message to send.
         :type msg: `str`
-        :param msg_type: The type of transmission, one of MSG, IMG, SES, FOL\
-            or LOG
+        :param msg_type: The type of transmission, one of MSG, IMG, SLD, BLB,\
+            THB, SES, FOL, HIS or LOG
         :type msg_type: `str`
         """
-        send_package(person.key, self.private_key, msg, msg_type,
-                     person.socket)
+        with person.send_lock:
+            send_package(person.key, self.private_key, msg, msg_type,
+                         person.socket)
 
     def _client_handler(self, person: Person) -> None:
         """
@@ -290,28 +397,52 @@ class Server(object):
         :type person: :class:`Person`
         """
         if self._login(person):
-            while True:
-                msg_type, msg = self.recv(person)
-                if msg_type == 'IMG':
-                    path = msg.decode.split(':')[1]
-                    self._serve_file(person, path)
-                elif msg_type == 'FOL':
-                    path = msg.decode().split(':')[1]
-                    self._add_folder(path, person)
-                elif msg == "/quit" or len(msg) == 0:
-                    message = ('%s has left the chat.' %
-                               person.options['CHAT_NAME'])
-                    self.broadcast(message, "")
-                    person.socket.close()
-                    with self.client_lock:
-                        self.clients.remove(person)
-                    break
-                else:
-                    self.broadcast(msg.decode(),
-                                   person.options['CHAT_NAME'] + ": ")
+            try:
+                while True:
+                    msg_type, msg = self.recv(person)
+                    if msg_type == 'IMG':
+                        path = msg.decode.split(':')[1]
+                        self._serve_file(person, path)
+                    elif msg_type == 'FOL':
+                        request = read_listing_request(msg)
+                        if request is not None:
+                            self._add_folder(request, person)
+                    elif msg_type == 'GET':
+                        self._serve_blob(person, msg.decode())
+                    elif msg_type == 'THB':
+                        width, height, path = msg.decode().split(':', 2)
+                        self._serve_thumbnails(person, path,
+                                               (int(width), int(height)))
+                    elif msg_type == 'HIS':
+                        self._serve_history(person, msg)
+                    elif msg == "/quit" or len(msg) == 0:
+                        break
+                    else:
+                        self.broadcast(msg.decode(),
+                                       person.options['CHAT_NAME'] + ": ")
+                        self.ai.answer(person, msg.decode())
+            finally:
+                self._leave(person)
         else:
             self.send_message(person, 'Something went wrong.', 'LOG')
 
+    def _leave(self, person: Person) -> None:
+        """
+        Cleans up after a client that quit or whose connection failed.  The
+        person's script is stopped and their script state flushed.
+
+        :param person: The person object for the client
+        :type person: :class:`Person`
+        """
+        self.ai.stop(person)
+        person.socket.close()
+        with self.client_lock:
+            if person in self.clients:
+                self.clients.remove(person)
+        self.broadcast('%s has left the chat.' % person.options['CHAT_NAME'],
+                       "")
+        self.state.unload(person.username)
+
     def _start_server(self) -> None:
         """Starts the server and handles incoming client connections."""
         self.queue.put("Running with %s active clients." % len(
@@ -359,6 +490,70 @@ class Server(object):
             for person in self.clients:
                 self.send_message(person, image, 'IMG')
 
+    def _broadcast_slide(self, data: bytes, present_at: float,
+                         generation: int,
+                         person: Person | None = None) -> None:
+        """
+        Announces a pre-rendered slide to connected clients ahead of time by
+        its content hash.  The announcement carries the slideshow generation,
+        the time it was sent and the time it should be presented, all in
+        server time.  Clients that don't have the hash cached request the
+        body with a GET.
+
+        :param data: The rendered image.
+        :type data: bytes
+        :param present_at: Server timestamp at which to display the slide.
+        :type present_at: float
+        :param generation: Slides from an older generation are discarded by\
+            the client.
+        :type generation: int
+        :param person: Send only to this client instead of everyone.
+        :type person: :class:`Person`
+        """
+        key = self._store_blob(data)
+        with self.client_lock:
+            recipients = self.clients if person is None else [person]
+            for recipient in recipients:
+                msg = '%d:%.3f:%.3f:%s' % (generation, time.time(),
+                                           present_at, key)
+                try:
+                    self.send_message(recipient, msg, 'SLD')
+                except socket.error as error:
+                    self.queue.put("Error: %s" % error.strerror)
+
+    def _store_blob(self, data: bytes) -> str:
+        """
+        Keeps a rendered image available for clients to request by hash and
+        returns the hash.  Only the last BLOBS images are kept.
+
+        :param data: The rendered image.
+        :type data: bytes
+        :return: Hex encoded SHA-256 of the image.
+        :rtype: str
+        """
+        key = digest(data)
+        with self.blob_lock:
+            self.blobs[key] = data
+            self.blobs.move_to_end(key)
+            while len(self.blobs) > BLOBS:
+                self.blobs.popitem(last=False)
+        return key
+
+    def _serve_blob(self, person: Person, key: str) -> None:
+        """
+        Answer a client's request for the body of an announced slide.  If
+        the slide was already evicted the body is empty, so the client stops
+        waiting for it.
+
+        :param person: An instance of the client's `Person` object.
+        :type person: :class:`Person`
+        :param key: The hash the slide was announced under.
+        :type key: str
+        """
+        with self.blob_lock:
+            data = self.blobs.get(key, b'')
+        self.send_message(person, key.encode() + b':' + data, 'BLB')
+
     def _serve_file(self, person: Person, file: str) -> None:
         """
         Answer a client's request to retrieve a file from the server
@@ -370,26 +565,135 @@ class Server(object):
         """
         self.send_message(person, file, 'IMG')
 
-    def _add_folder(self, path, person: Person):
+    def _serve_history(self, person: Person, msg: bytes) -> None:
         """
-        Answer a client's request to populate the server browser window
+        Answer a client's request for the page of chat history before a
+        line.  Malformed requests get an empty page.
+
+        :param person: An instance of the client's `Person` object.
+        :type person: :class:`Person`
+        :param msg: The id of the line to page back from.
+        :type msg: bytes
         """
-        files = []
-        folders = []
         try:
-            for item in os.listdir(path):
-                if not item.startswith('.'):
-                    fqp = os.path.join(path, item)
-                    if os.path.isdir(fqp):
-                        folders.append(item)
-                    elif item.endswith(('jpg', 'jpeg', 'gif', 'png', 'bmp')):
-                        files.append(item)
-        except PermissionError:
-            pass
-        folders = 'FOLDERS:' + ((',').join(folders)
-                                if folders else 'NULL') + ':'
-        files = 'FILES:' + ((',').join(files) if files else 'NULL')
-        self.send_message(person, folders + files, 'FOL')
+            lines = self.chat.page(int(msg.decode('ascii')))
+        except (ValueError, OverflowError):
+            lines = []
+        self.send_message(person, pack(lines), 'HIS')
+
+    def _serve_thumbnails(self, person: Person, path: str,
+                          size: tuple[int, int]) -> None:
+        """
+        Answer a client's request for the thumbnails of every image in a
+        folder.  They are sent a page at a time as they are generated, so
+        the client can show the first ones while the rest are still being
+        made and no single frame grows with the size of the folder.
+
+        :param person: An instance of the client's `Person` object.
+        :type person: :class:`Person`
+        :param path: /path/to/folder
+        :type path: str
+        :param size: The size of the thumbnails. (width, height)
+        :type size: tuple[int, int]
+        """
+        for page in self.thumbnails.pages(path, size):
+            self.send_message(person, pack_thumbnails(page), 'THB')
+
+    def _listing(self, path: str) -> list[tuple[bool, str, str]]:
+        """
+        Returns the entries of a directory sorted folders first, then by
+        name without regard to case.  Listings are cached until the
+        directory's modification time changes.
+
+        :param path: /path/to/folder
+        :type path: str
+        :return: Entries as (is_file, lowercase name, name) tuples.
+        :rtype: list[tuple[bool, str, str]]
+        """
+        mtime = os.stat(path).st_mtime_ns
+        with self.listing_lock:
+            cached = self.listings.get(path)
+            if cached is not None and cached[0] == mtime:
+                self.listings.move_to_end(path)
+                return cached[1]
+        entries = []
+        with os.scandir(path) as items:
+            for item in items:
+                if item.name.startswith('.'):
+                    continue
+                try:
+                    is_dir = item.is_dir()
+                except OSError:
+                    continue
+                entries.append((not is_dir, item.name.lower(), item.name))
+        entries.sort()
+        with self.listing_lock:
+            self.listings[path] = (mtime, entries)
+            while len(self.listings) > LISTINGS:
+                self.listings.popitem(last=False)
+        return entries
+
+    def _add_folder(self, request: dict[str, Any], person: Person) -> None:
+        """
+        Answer a client's request to populate the server browser window.
+        The listing is streamed as a series of pages, each sent as soon as
+        it is filled, so the client can render the first page immediately.
+
+        The request may contain:
+        - path: The folder to list.
+        - cursor: Resume after this entry, as returned with a page.
+        - limit: Maximum number of entries per page.
+        - pages: Maximum number of pages to send, all of them by default.
+        - ext: Only list files with one of these extensions.
+        - prefix: Only list entries whose name starts with this.
+
+        :param request: The request, see `read_listing_request()`.
+        :type request: dict[str, Any]
+        :param person: An instance of the client's `Person` object.
+        :type person: :class:`Person`
+        """
+        path = request['path']
+        limit = request.get('limit') or PAGE
+        pages = request.get('pages')
+        ext = tuple(e.lower() for e in request.get('ext') or ())
+        prefix = (request.get('prefix') or '').lower()
+        try:
+            entries = self._listing(path)
+        except OSError:
+            entries = []
+        cursor = request.get('cursor')
+        index = bisect_right(entries, tuple(cursor)) if cursor else 0
+        if prefix:
+            index = max(index, bisect_left(entries, (False, prefix)))
+        while pages is None or pages > 0:
+            folders: list[str] = []
+            files: list[str] = []
+            while index < len(entries) and len(folders) + len(files) < limit:
+                is_file, lower, name = entries[index]
+                index += 1
+                if prefix and not lower.startswith(prefix):
+                    if lower < prefix:
+                        index = max(index, bisect_left(entries,
+                                                       (is_file, prefix)))
+                    elif is_file:
+                        index = len(entries)
+                    else:
+                        index = max(index, bisect_left(entries,
+                                                       (True, prefix)))
+                    continue
+                if not is_file:
+                    folders.append(name)
+                elif not ext or lower.endswith(ext):
+                    files.append(name)
+            cursor = list(entries[index - 1]) if index < len(entries) \
+                else None
+            page = {'path': path, 'folders': folders, 'files': files,
+                    'cursor': cursor, 'total': len(entries)}
+            self.send_message(person, json.dumps(page), 'FOL')
+            if cursor is None:
+                break
+            if pages is not None:
+                pages -= 1
 
 
 class SlideShow(object):
@@ -397,7 +701,10 @@ class SlideShow(object):
 
     def __init__(self, folder: str, server: Server) -> None:
         """
-        Initializes the slideshow.
+        Initializes the slideshow.  Upcoming slides are rendered PREFETCH
+        slides ahead by a background thread and pushed to the clients with a
+        presentation timestamp, so transitions happen on time regardless of
+        encode and transfer time.
 
         Public methods:
         - start(): Start the slideshow.
@@ -405,6 +712,8 @@ class SlideShow(object):
         - next(): Display the next slide.
         - back(): Display the previous slide.
         - update(): Update the slideshow.
+        - replay(): Send the current and pending slides to a newly joined\
+          client.
 
         :param folder: /path/to/folder containing slideshow images.
         :type folder: string
@@ -418,6 +727,13 @@ class SlideShow(object):
         self.randomize = self.server.opt_get('randomize')
         self.started = False
         self.images = []
+        self.playlist: Playlist | None = None
+        self.generation = 0
+        self.shown_at = 0.0
+        self.current: bytes | None = None
+        self.schedule: deque[tuple[int, float, bytes]] = deque()
+        self.rendering = False
+        self.cond = Condition()
 
     def _add_folder(self, folder: str) -> None:
         """
@@ -445,73 +761,337 @@ class SlideShow(object):
     def start(self) -> None:
         """Start the slideshow."""
         self._add_folder(self.directory)
+        if not self.images:
+            return
+        self.playlist = Playlist(len(self.images),
+                                 self.server.opt_get('randomize') == '1')
         self.started = True
-        self._show()
+        self._jump(self.playlist.next)
+        Thread(target=self._prefetch, daemon=True).start()
 
     def stop(self) -> None:
         """Stop the slideshow."""
-        self.started = False
+        with self.cond:
+            self.started = False
+            self.generation += 1
+            self.schedule.clear()
+            self.cond.notify_all()
+
+    def _prefetch(self) -> None:
+        """
+        Background thread that keeps PREFETCH slides rendered and pushed to
+        the clients ahead of their presentation time.
+        """
+        while True:
+            with self.cond:
+                while self.started and len(self.schedule) >= PREFETCH:
+                    self.cond.wait()
+                if not self.started:
+                    return
+                generation = self.generation
+                present_at = (self.schedule[-1][1] if self.schedule
+                              else self.shown_at) + INTERVAL
+                index = self.playlist.next()
+                self.rendering = True
+            data = get_image(self.images[index])
+            with self.cond:
+                self.rendering = False
+                if generation != self.generation:
+                    continue
+                self.schedule.append((index, present_at, data))
+            self.server._broadcast_slide(data, present_at, generation)
+
+    def _jump(self, step: Callable[[], int]) -> None:
+        """
+        Displays a slide immediately, discarding everything already pushed
+        to the clients.  The playlist is first stepped back over the
+        discarded slides so it points at the slide on screen again.
 
-    def _show(self) -> None:
-        """Display the current slideshow image."""
-        image = self.images[self.index]
-        self.server._broadcast_image(image)
+        :param step: Playlist method that picks the slide to display.
+        :type step: Callable[[], int]
+        """
+        with self.cond:
+            for _ in range(len(self.schedule) + self.rendering):
+                self.playlist.back()
+            self.generation += 1
+            self.schedule.clear()
+            index = self.index = step()
+            shown_at = self.shown_at = time.time()
+            self.current = None
+            generation = self.generation
+            self.cond.notify_all()
+        data = get_image(self.images[index])
+        with self.cond:
+            if generation == self.generation:
+                self.current = data
+        self.server._broadcast_slide(data, shown_at, generation)
+
+    def replay(self, person: Person) -> None:
+        """
+        Sends the slide on screen and the slides already pushed to everyone
+        else to a client that joined late.
+
+        :param person: The newly joined client.
+        :type person: :class:`Person`
+        """
+        with self.cond:
+            pending = list(self.schedule)
+            if self.current is not None:
+                pending.insert(0, (self.index, self.shown_at, self.current))
+            generation = self.generation
+        for _, present_at, data in pending:
+            self.server._broadcast_slide(data, present_at, generation, person)
 
     def next(self) -> None:
         """Advance the slideshow to the next slide."""
-        if self.server.opt_get('randomize') == '1':
-            self.index = random.randint(0, len(self.images) - 1)
-        else:
-            if self.index + 1 == len(self.images):
-                self.index = 0
-            else:
-                self.index += 1
-        self._show()
+        self._jump(self.playlist.next)
 
     def back(self) -> None:
         """Display the previous slide."""
-        self.index -= 1
-        self._show()
+        self._jump(self.playlist.back)
 
     def update(self, delta: float) -> None:
         """
-        Update the slideshow.
+        Update the slideshow.  The clients swap slides on their own at the
+        presentation time, so this only retires slides that are due and
+        wakes the prefetcher to render the next one.
 
         :param delta: The amount of time since the last update.
         :type delta: float
         """
         if self.started is True:
             self.time += delta
-            if self.time > 3:
-                self.time = 0
-                self.next()
+            now = time.time()
+            with self.cond:
+                while self.schedule and self.schedule[0][1] <= now:
+                    self.index, self.shown_at, self.current = \
+                        self.schedule.popleft()
+                    self.time = 0
+                    self.cond.notify_all()
+
+
+class ScriptSession(object):
+    """A script running for one person."""
+
+    __slots__ = ('person', 'parser', 'script', 'ticket', 'waiting', 'paused')
+
+    def __init__(self, person: Person, parser: Parser) -> None:
+        """
+        Initializes the session.
+
+        :param person: The person the script is running for.
+        :type person: :class:`Person`
+        :param parser: The parser running the script.
+        :type parser: :class:`Parser`
+        """
+        self.person = person
+        self.parser = parser
+        self.script = parser.run()
+        self.ticket = 0
+        self.waiting = False
+        self.paused = False
 
 
 class AI(object):
-    """Class for AI domme"""
+    """
+    Class for AI domme.  Scripts run as coroutines, see `Parser.run()`, and a
+    single scheduler thread resumes each one when what it is waiting for
+    happens: a timer expiring or the person answering in chat.  A watcher
+    thread recompiles edited scripts, and running sessions switch to the new
+    version the next time they pause between lines.
+    """
 
     def __init__(self, server: Server) -> None:
         """
         Initializes the AI
 
+        Public methods:
+        - start(): Start a script for a person.
+        - answer(): Hand a chat message to a person's script.
+        - stop(): Stop a person's script.
+
         :param server: An instance of a server object
         :type server: :class: `Server`
         """
         self.server = server
         self.name = server.opt_get('domme-name')
         self.folder = server.opt_get('folder')
-        self.time = random.uniform(0.0, 3.0)
-        self.delta = 0
-        self.lines = []
-        self.index = 0
-        self.parser = Parser('./Scripts/Start/HappyToSeeMe.md', self.server)
         self.flags = {}
+        self.catalog = Catalog()
+        self.sessions: dict[Person, ScriptSession] = {}
+        self.timers: list[tuple[float, int, ScriptSession, int]] = []
+        self.ready: deque[tuple[ScriptSession, str | None]] = deque()
+        self.sequence = 0
+        self.cond = Condition()
+        self.thread: Thread | None = None
+
+    def start(self, person: Person, script: str | None = None) -> None:
+        """
+        Starts a script for a person, replacing any script already running.
 
-    def update(self, delta):
+        :param person: The person to run the script for.
+        :type person: :class:`Person`
+        :param script: /path/to/script, defaults to a random script from the\
+            Start category of the catalog.
+        :type script: str | None
         """
-        Runs the next line of a script.
+        if script is None:
+            entry = self.catalog.pick('Start')
+            script = START_SCRIPT if entry is None else entry.path
+        state = self.server.state
+        state.set(person.username, 'var:chat_name',
+                  person.options.get('CHAT_NAME', person.username))
+        session = ScriptSession(person, Parser(script, self.server,
+                                               person.username, state))
+        with self.cond:
+            self.sessions[person] = session
+            self.ready.append((session, None))
+            if self.thread is None:
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+                Thread(target=self._watch, daemon=True).start()
+            self.cond.notify()
+
+    def answer(self, person: Person, text: str) -> None:
         """
-        ...
+        Resumes a person's script with their chat message if it is waiting
+        for an answer.
+
+        :param person: The person who sent the message.
+        :type person: :class:`Person`
+        :param text: The message.
+        :type text: str
+        """
+        with self.cond:
+            session = self.sessions.get(person)
+            if session is None or not session.waiting:
+                return
+            session.waiting = False
+            session.ticket += 1
+            self.ready.append((session, text))
+            self.cond.notify()
+
+    def stop(self, person: Person) -> None:
+        """
+        Stops a person's script.
+
+        :param person: The person whose script to stop.
+        :type person: :class:`Person`
+        """
+        with self.cond:
+            session = self.sessions.pop(person, None)
+            if session is not None:
+                session.ticket += 1
+
+    def _wake(self, session: ScriptSession, seconds: float) -> None:
+        """Resumes a session after a delay.  Call with the lock held."""
+        self.sequence += 1
+        heapq.heappush(self.timers, (time.monotonic() + seconds,
+                                     self.sequence, session, session.ticket))
+        self.cond.notify()
+
+    def _run(self) -> None:
+        """Scheduler thread resuming the sessions that are due."""
+        while True:
+            with self.cond:
+                while not self.ready:
+                    now = time.monotonic()
+                    if self.timers and self.timers[0][0] <= now:
+                        _, _, session, ticket = heapq.heappop(self.timers)
+                        if session.ticket == ticket:
+                            session.waiting = False
+                            session.ticket += 1
+                            self.ready.append((session, None))
+                        continue
+                    self.cond.wait(self.timers[0][0] - now if self.timers
+                                   else None)
+                session, reply = self.ready.popleft()
+                if self.sessions.get(session.person) is not session:
+                    continue
+            self._resume(session, reply)
+
+    def _watch(self) -> None:
+        """
+        Watcher thread recompiling the scripts in use when they are edited.
+        """
+        while True:
+            time.sleep(WATCH)
+            try:
+                changed = self.catalog.refresh()
+            except Exception as error:
+                self.server.queue.put('Script watcher error: %s' % error)
+                continue
+            for script in changed:
+                if loaded_program(script) is None:
+                    continue
+                start = time.perf_counter()
+                try:
+                    load_program(script)
+                except Exception as error:
+                    self.server.queue.put('Failed to reload %s: %s' % (
+                        script, error))
+                    continue
+                self.server.queue.put('Reloaded %s in %.1f ms.' % (
+                    script, (time.perf_counter() - start) * 1000))
+
+    def _resume(self, session: ScriptSession, reply: Any) -> None:
+        """
+        Runs a session's script until it has to wait, carrying out the
+        requests it makes along the way.
+
+        :param session: The session to resume.
+        :type session: :class:`ScriptSession`
+        :param reply: The value to resume the script with.
+        :type reply: Any
+        """
+        if session.paused:
+            session.paused = False
+            if session.parser.reload():
+                self.server.queue.put('%s switched to the new %s.' % (
+                    session.person.name, session.parser.program.script))
+        while True:
+            try:
+                request = session.script.send(reply)
+            except StopIteration:
+                self.stop(session.person)
+                return
+            except Exception as error:
+                self.server.queue.put('Script error: %s' % error)
+                self.stop(session.person)
+                return
+            reply = None
+            try:
+                if isinstance(request, Say):
+                    self.server.send_message(
+                        session.person, '%s: %s' % (self.name,
+                                                    request.text.strip('"')),
+                        'MSG')
+                elif isinstance(request, ShowMedia):
+                    reply = self.server.media.sample(request.pool,
+                                                     session.person)
+                    if reply is not None:
+                        self.server.send_message(session.person, reply,
+                                                 'IMG')
+                elif isinstance(request, WaitTime):
+                    with self.cond:
+                        session.paused = True
+                        self._wake(session, request.seconds)
+                    return
+                elif isinstance(request, WaitAnswer):
+                    if request.options:
+                        self.server.send_message(
+                            session.person, '%s: (%s)' % (
+                                self.name, ' / '.join(request.options)),
+                            'MSG')
+                    with self.cond:
+                        session.waiting = True
+                        if request.timeout is not None:
+                            self._wake(session, request.timeout)
+                    return
+            except socket.error as error:
+                self.server.queue.put("Error: %s" % error.strerror)
+                self.stop(session.person)
+                return
 
 
 if __name__ == '__main__':
@@ -2,6 +2,7 @@
 """Custom server browser class and associated functions."""
 from __future__ import annotations
 
+import json
 import os
 from io import BytesIO
 
@@ -9,6 +10,8 @@ from io import BytesIO
 from server import Server
 import PySimpleGUI as sG
 
+EXTENSIONS = ('jpg', 'jpeg', 'gif', 'png', 'bmp')
+
 
 class ServerBrowser():
     """Class for custom server browser widget."""
@@ -30,8 +33,7 @@ class ServerBrowser():
         self.client = client
         self.path = str(self.client.session.srv_folder) if path == '' else path
         self.treedata = sG.TreeData()
-        folders, files = self._request_folder(self.path)
-        self._add_folder(self.path, folders, files)
+        self.pending: str | None = None
 
         self.layout = [
             [sG.B('', image_filename='icons/browse_back.png', k='BACK',
@@ -54,31 +56,48 @@ class ServerBrowser():
             self.media_player = self.client.window['IMAGE'].get_size()
         self.window['PATH'].expand(expand_x=True, expand_y=True)
         self.window['FILES'].bind('<Double-Button-1>', '_double_clicked')
+        self._request_folder(self.path)
+        self._request_thumbnails(self.path)
 
-    def _request_folder(self, path: str) -> tuple[list[str], list[str]]:
+    def _request_folder(self, path: str) -> None:
         """
-        Request a listing of folder contents from the server and return a\
-            list of folders and files at the given path.
+        Request a listing of folder contents from the server.  The listing
+        arrives in pages which are added to the tree as they come in.
 
         :param path: The path to request the contents of.
         :type path: str
-        :returns: A list of folders and a list of files at the given path.
-        :rtype: tuple[list[str], list[str]]
         """
-        self.client.send_message('PATH:%s' % path)
-        folders = self.client.session.browser_folders
-        files = self.client.session.browser_files
-        while folders[0] == 'None' or files[0] == 'None':
-            folders = self.client.session.browser_folders
-            files = self.client.session.browser_files
-        self.client.session.browser_folders = ['None']
-        self.client.session.browser_files = ['None']
-        return (folders, files)
+        request = {'path': path, 'ext': EXTENSIONS}
+        self.client.send_message(json.dumps(request), 'FOL')
+
+    def _request_thumbnails(self, path: str) -> None:
+        """
+        Ask the server for the thumbnails of every image in a folder.  They
+        arrive in the background.
+
+        :param path: The folder to request thumbnails for.
+        :type path: str
+        """
+        self.client.send_message('%d:%d:%s' % (*self.preview_frame, path),
+                                 'THB')
+
+    def _add_pages(self) -> None:
+        """Add every page of the listing received so far to the tree."""
+        pages = self.client.session.browser_pages
+        added = False
+        while not pages.empty():
+            page = pages.get()
+            if page['path'] == self.path:
+                self._add_folder(page['path'], page['folders'],
+                                 page['files'])
+                added = True
+        if added:
+            self.window['FILES'].update(values=self.treedata)
 
     def _add_folder(self, path: str, folders: list[str],
                     files: list[str]) -> None:
         """
-        Add a folder to the tree.
+        Add a page of a folder listing to the tree.
 
         :param path: The path to populate on the tree.
         :type path: string
@@ -89,21 +108,15 @@ class ServerBrowser():
         """
         folder_icon = 'icons/folder.png'
         parent = ''
-        for folder in sorted(folders, key=str.lower):
+        for folder in folders:
             fqp = os.path.join(path, folder)
-            if folder != 'NULL':
-                self.treedata.insert(parent, fqp, '  ' + folder, [fqp],
-                                     icon=folder_icon)
-            else:
-                self.treedata.insert(parent, None, '...', [], None)
+            self.treedata.insert(parent, fqp, '  ' + folder, [fqp],
+                                 icon=folder_icon)
         file_icon = 'icons/file.png'
-        for file in sorted(files):
+        for file in files:
             fqp = os.path.join(path, file)
-            if file != 'NULL':
-                self.treedata.insert(parent, fqp, '  ' +
-                                     file, [fqp], icon=file_icon)
-            else:
-                self.treedata.insert(parent, None, '...', [], None)
+            self.treedata.insert(parent, fqp, '  ' + file, [fqp],
+                                 icon=file_icon)
 
     def _change_path(self, path: str) -> None:
         """
@@ -115,8 +128,8 @@ class ServerBrowser():
         self.history = self.path
         self.path = path
         self.treedata = sG.TreeData()
-        folders, files = self._request_folder(path)
-        self._add_folder(path, folders, files)
+        self._request_folder(path)
+        self._request_thumbnails(path)
         self.window['FILES'].update(values=self.treedata)
         self.window['PATH'].update(value=path)
         self.window['UP'].update(disabled=(False, True)[self.path == '/'])
@@ -125,17 +138,16 @@ class ServerBrowser():
 
     def preview(self, img: str) -> None:
         """
-        Display an image in the preview pane.
+        Display an image's thumbnail in the preview pane, or display it as
+        soon as it arrives from the server.
 
         :param img: Path to the image file to be displayed.
         :type img: string
         """
-        self.client.recv_lock.acquire()
-        image = self.client._request_file(img, self.preview_frame)
-        self.client.recv_lock.release()
-        with BytesIO() as bio:
-            image.save(bio, format="PNG")
-            self.window['IMAGE'].update(data=bio.getvalue())
+        thumbnail = self.client.session.thumbnails.get(img)
+        self.pending = img if thumbnail is None else None
+        if thumbnail is not None:
+            self.window['IMAGE'].update(data=thumbnail)
 
     def select_folder(self, values: dict) -> str:
         """
@@ -158,9 +170,13 @@ class ServerBrowser():
     def show(self) -> str:
         """Show the file browser window."""
         while True:
-            event, values = self.window.read()
+            event, values = self.window.read(timeout=100)
             if event in ['Cancel', None]:
                 return self.path
+            elif event == sG.TIMEOUT_KEY:
+                self._add_pages()
+                if self.pending is not None:
+                    self.preview(self.pending)
             elif event == 'UP':
                 self._change_path(os.path.dirname(self.path))
             elif event == 'BACK':
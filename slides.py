@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Client-side buffering of slides announced ahead of time by the server"""
+from __future__ import annotations
+
+import heapq
+import time
+from threading import Lock
+from typing import Any, Callable
+
+from image_cache import ImageCache
+
+WANTED = 5.0
+
+
+class SlideBuffer(object):
+    """
+    Buffers the slides a server announces ahead of their presentation time
+    (SLD frames) until they are due.  Slide bodies come from the image cache
+    or are requested from the server by hash and arrive in BLB frames.  The
+    offset between the server's clock and ours is estimated as the smallest
+    observed difference between the send and receive times of announcements.
+    """
+
+    def __init__(self, cache: ImageCache,
+                 prepare: Callable[[bytes], Any] = bytes) -> None:
+        """
+        Initializes an empty buffer.
+
+        Public methods:
+        - announce(): Handle an SLD frame.
+        - receive(): Handle a BLB frame.
+        - due(): Take the slide to show now.
+
+        :param cache: Cache of slide bodies by hash.
+        :type cache: :class:`ImageCache`
+        :param prepare: Turns a slide body into what is shown, called when\
+            the slide is buffered rather than when it is due.
+        :type prepare: Callable[[bytes], Any]
+        """
+        self.cache = cache
+        self.prepare = prepare
+        self.wanted: dict[str, list[tuple[int, float]]] = {}
+        self.requested: dict[str, float] = {}
+        self.slides: list[tuple[float, int, Any]] = []
+        self.generation = 0
+        self.count = 0
+        self.clock_offset: float | None = None
+        self.lock = Lock()
+
+    def announce(self, msg: str) -> str | None:
+        """
+        Handles a slide announcement.  Slides already in the cache are
+        buffered right away, others have to be requested from the server.
+        Requests left unanswered for WANTED seconds are made again if the
+        slide is announced again, and dropped otherwise.
+
+        :param msg: Generation, send time, presentation time and content\
+            hash, separated by colons.
+        :type msg: str
+        :return: The hash to request from the server with a GET, if any.
+        :rtype: str | None
+        """
+        generation, sent_at, present_at, key = msg.split(':')
+        offset = time.time() - float(sent_at)
+        if self.clock_offset is None or offset < self.clock_offset:
+            self.clock_offset = offset
+        if int(generation) < self.generation:
+            return None
+        data = self.cache.get(key)
+        if data is not None:
+            self._buffer(int(generation), float(present_at), data)
+            return None
+        self.wanted.setdefault(key, []).append((int(generation),
+                                                float(present_at)))
+        now = time.monotonic()
+        for stale, requested in list(self.requested.items()):
+            if now - requested >= WANTED and stale != key:
+                del self.requested[stale]
+                self.wanted.pop(stale, None)
+        if now - self.requested.get(key, now - WANTED) < WANTED:
+            return None
+        self.requested[key] = now
+        return key
+
+    def receive(self, msg: bytes) -> bool:
+        """
+        Stores the body of a requested slide and buffers every announcement
+        that was waiting for it.  An empty body means the server no longer
+        has the slide, which is then skipped.
+
+        :param msg: The content hash and the encoded image, separated by a\
+            colon.
+        :type msg: bytes
+        :return: False if the slide was missing or corrupt.
+        :rtype: bool
+        """
+        key, data = msg.split(b':', 1)
+        key = key.decode()
+        self.requested.pop(key, None)
+        waiting = self.wanted.pop(key, [])
+        if not data:
+            return False
+        stored = self.cache.put(key, data)
+        for generation, present_at in waiting:
+            self._buffer(generation, present_at, data)
+        return stored
+
+    def _buffer(self, generation: int, present_at: float,
+                data: bytes) -> None:
+        """
+        Buffers a slide until its presentation time.  A newer generation
+        discards the slides of older ones.
+        """
+        if generation < self.generation:
+            return
+        image = self.prepare(data)
+        with self.lock:
+            if generation > self.generation:
+                self.generation = generation
+                self.slides.clear()
+            elif generation < self.generation:
+                return
+            self.count += 1
+            heapq.heappush(self.slides, (present_at, self.count, image))
+
+    def due(self) -> Any | None:
+        """
+        Takes the latest buffered slide whose time has come.  When the
+        client has fallen behind, the earlier due slides are skipped.
+
+        :return: The prepared slide, or None if none is due.
+        :rtype: Any | None
+        """
+        now = time.time() - (self.clock_offset or 0.0)
+        image = None
+        with self.lock:
+            while self.slides and self.slides[0][0] <= now:
+                image = heapq.heappop(self.slides)[2]
+        return image
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Write-behind store for the flags and variables scripts keep per user"""
+from __future__ import annotations
+
+import pickle
+import sqlite3
+from typing import Any
+
+from write_behind import DB, FLUSH, WriteBehind
+
+
+class StateStore(WriteBehind):
+    """
+    Per-user key-value state held in memory and written to the `user_state`
+    table in batches.  Writes only mark keys dirty; a background thread
+    flushes the dirty keys in one transaction every FLUSH seconds, and
+    `unload()` flushes a user's keys when they disconnect.
+    """
+
+    def __init__(self, db: str | None = DB, interval: float = FLUSH) -> None:
+        """
+        Opens the store.
+
+        Public methods:
+        - get(): Read a value.
+        - set(): Write a value.
+        - flush(): Write the dirty values to the database.
+        - unload(): Flush a user's values and drop them from memory.
+        - close(): Flush everything and stop the flush thread.
+
+        :param db: /path/to/database, or None to keep state in memory only.
+        :type db: str | None
+        :param interval: Seconds between flushes.
+        :type interval: float
+        """
+        self.users: dict[str, dict[str, Any]] = {}
+        self.dirty: set[tuple[str, str]] = set()
+        super().__init__(db, interval)
+
+    def _load(self, user: str) -> dict[str, Any]:
+        """Returns a user's state, reading it from the database once."""
+        state = self.users.get(user)
+        if state is None:
+            state = {}
+            if self.db is not None:
+                con = sqlite3.connect(self.db)
+                try:
+                    for key, value in con.execute(
+                            'SELECT key, value FROM user_state '
+                            'WHERE username = ?', (user,)):
+                        state[key] = pickle.loads(value)
+                finally:
+                    con.close()
+            self.users[user] = state
+        return state
+
+    def get(self, user: str, key: str, default: Any = None) -> Any:
+        """
+        Reads a value.
+
+        :param user: The user the value belongs to.
+        :type user: str
+        :param key: The name of the value.
+        :type key: str
+        :param default: Returned if the value was never set.
+        :type default: Any
+        :return: The value.
+        :rtype: Any
+        """
+        state = self.users.get(user)
+        if state is None:
+            with self.cond:
+                state = self._load(user)
+        return state.get(key, default)
+
+    def set(self, user: str, key: str, value: Any) -> None:
+        """
+        Writes a value.  It reaches the database with the next flush.
+
+        :param user: The user the value belongs to.
+        :type user: str
+        :param key: The name of the value.
+        :type key: str
+        :param value: The value, anything that can be pickled.
+        :type value: Any
+        """
+        with self.cond:
+            state = self._load(user)
+            if key in state and state[key] == value:
+                return
+            state[key] = value
+            self.dirty.add((user, key))
+
+    def flush(self, user: str | None = None) -> int:
+        """
+        Writes dirty values to the database in one transaction.
+
+        :param user: Only flush this user's values.
+        :type user: str | None
+        :return: The number of values written.
+        :rtype: int
+        """
+        return super().flush(user)
+
+    def _take(self, user: str | None = None) -> list[tuple]:
+        """Removes and returns the dirty values, all or a user's."""
+        keys = [item for item in self.dirty
+                if user is None or item[0] == user]
+        self.dirty.difference_update(keys)
+        return [(name, key, pickle.dumps(self.users[name][key]))
+                for name, key in keys]
+
+    def _write(self, con: sqlite3.Connection, rows: list[tuple]) -> None:
+        """Writes dirty values."""
+        con.executemany('REPLACE INTO user_state VALUES (?, ?, ?)', rows)
+
+    def _restore(self, rows: list[tuple]) -> None:
+        """Marks values that failed to write dirty again."""
+        self.dirty.update((name, key) for name, key, _ in rows)
+
+    def unload(self, user: str) -> None:
+        """
+        Flushes a user's values and drops them from memory.
+
+        :param user: The user.
+        :type user: str
+        """
+        self.flush(user)
+        with self.cond:
+            if not any(item[0] == user for item in self.dirty):
+                self.users.pop(user, None)
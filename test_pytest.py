@@ -1,8 +1,39 @@
+import json
+import os
 import random
+import shutil
+import socket
+import sqlite3
 import string
+import time
+import zlib
 from io import BytesIO
+from threading import Event, Thread
+from types import SimpleNamespace
+
+import pytest
 
 import crypto_functions
+from catalog import Catalog
+from chat_log import ChatLog, pack, unpack
+from convert import convert
+from decoder import Decoder
+from image_cache import ImageCache, digest
+from media_index import MediaIndex
+from migrations import MIGRATIONS, migrate
+from playlist import Playlist
+from profiler import Profile, simulate
+from server import INTERVAL, PREFETCH, SlideShow, read_listing_page, \
+    read_listing_request
+from script_parser import ANCHOR, ANSWER, CALL, MEANINGLESS, RANDINT, SAY, \
+    VAR, VOCAB, AnswerIndex, Parser, Say, ShowMedia, WaitAnswer, WaitTime, \
+    compile_line, compile_script, link, load_program, load_script, tokenize
+from slides import SlideBuffer
+from state_store import StateStore
+from thumbnails import ThumbnailService, pack_thumbnails, \
+    unpack_thumbnails
+from vocab_import import import_groups
+from vocabulary import Vocabulary
 
 
 def random_string():
@@ -19,6 +50,14 @@ def random_bytes():
     return ''.join(random.choice(chars) for _ in range(length)).encode()
 
 
+@pytest.fixture
+def db(tmp_path):
+    """A copy of the bundled database that the test may modify"""
+    path = str(tmp_path / 'teaseai.db')
+    shutil.copy('teaseai.db', path)
+    return path
+
+
 def test_package():
     """Unit test for the package function from crypto_functions module"""
     priv, pub = crypto_functions.get_key_pair()
@@ -34,6 +73,15 @@ def test_package():
         dec_msg = crypto_functions.Fernet(f_key).decrypt(enc_msg)
         assert crypto_functions._bytes(dec_msg) == \
             crypto_functions._bytes(case)
+    sender, receiver = socket.socketpair()
+    with sender, receiver:
+        big = os.urandom(4 * 1024 * 1024)
+        thread = Thread(target=crypto_functions.send_package,
+                        args=(pub, priv, big, 'BLB', sender))
+        thread.start()
+        assert crypto_functions.open_package(pub, priv, receiver) == \
+            ('BLB', big)
+        thread.join()
 
 
 def test_sign_and_verify():
@@ -52,7 +100,478 @@ def test_bytes():
         assert type(data) == bytes
 
 
+def test_playlist():
+    """Unit test for the shuffled playlist and its history"""
+    for size in (1, 2, 7, 1000, random.randint(3, 5000)):
+        playlist = Playlist(size, seed=size)
+        lap = [playlist.next() for _ in range(size)]
+        assert sorted(lap) == list(range(size))
+    playlist = Playlist(50, history=10)
+    played = [playlist.next() for _ in range(20)]
+    assert playlist.back() == played[-2]
+    assert playlist.back() == played[-3]
+    assert playlist.next() == played[-2]
+    assert playlist.next() == played[-1]
+    assert playlist.next() not in played[-10:]
+    for _ in range(20):
+        oldest = playlist.back()
+    assert oldest == playlist.history[0]
+    assert [Playlist(5, shuffle=False).next() for _ in range(3)] == [0, 0, 0]
+
+
+def test_decoder():
+    """Unit test for dropping superseded images"""
+    gate, started = Event(), Event()
+    decoded, delivered = [], []
+
+    def decode(data):
+        decoded.append(data)
+        if data == b'1':
+            started.set()
+            gate.wait(5)
+        return data
+
+    decoder = Decoder(decode, workers=1)
+    decoder.latest(b'1', delivered.append)
+    assert started.wait(5)
+    decoder.latest(b'2', delivered.append)
+    decoder.latest(b'3', delivered.append)
+    gate.set()
+    decoder.pool.shutdown(wait=True)
+    assert decoded == delivered == [b'1', b'3']
+    gate.clear()
+    started.clear()
+    decoded.clear()
+    delivered.clear()
+    decoder = Decoder(decode, workers=2)
+    decoder.latest(b'1', delivered.append)
+    assert started.wait(5)
+    decoder.latest(b'2', delivered.append)
+    deadline = time.monotonic() + 5
+    while not delivered and time.monotonic() < deadline:
+        time.sleep(0.01)
+    gate.set()
+    decoder.pool.shutdown(wait=True)
+    assert decoded == [b'1', b'2'] and delivered == [b'2']
+
+
+def test_image_cache(tmp_path):
+    """Unit test for the content-addressed client image cache"""
+    cache = ImageCache(str(tmp_path), 4096)
+    blobs = [random_bytes()[:1500].ljust(1500, b'x') for _ in range(3)]
+    keys = [digest(blob) for blob in blobs]
+    assert not cache.put(keys[0], blobs[1])
+    assert cache.put(keys[0], blobs[0])
+    assert cache.put(keys[1], blobs[1])
+    assert cache.get(keys[0]) == blobs[0]
+    assert cache.put(keys[2], blobs[2])
+    assert keys[1] not in cache and cache.get(keys[1]) is None
+    reopened = ImageCache(str(tmp_path), 4096)
+    assert reopened.get(keys[0]) == blobs[0] and keys[2] in reopened
+    assert reopened.size == 3000
+
+
+def test_slideshow(tmp_path):
+    """Unit test for prefetching slides with presentation timestamps"""
+    for i in range(8):
+        crypto_functions.Image.new('RGB', (8, 8), (i, 0, 0)).save(
+            tmp_path / ('%d.png' % i))
+    sent, done = [], Event()
+
+    def broadcast(data, present_at, generation, person=None):
+        sent.append((data, present_at, generation, person))
+        if len(sent) == PREFETCH + 1:
+            done.set()
+
+    server = SimpleNamespace(opt_get=lambda option: '0',
+                             _broadcast_slide=broadcast)
+    show = SlideShow(str(tmp_path), server)
+    show.start()
+    assert done.wait(5)
+    times = [present_at for _, present_at, _, _ in sent]
+    assert [round(b - a, 6) for a, b in zip(times, times[1:])] == \
+        [INTERVAL] * PREFETCH
+    assert {generation for _, _, generation, _ in sent} == {show.generation}
+    assert len(show.schedule) == PREFETCH
+    del sent[:]
+    show.replay('late')
+    assert [(data, present_at) for data, present_at, _, _ in sent] == \
+        list(zip([show.current] + [data for _, _, data in show.schedule],
+                 times))
+    assert {person for _, _, _, person in sent} == {'late'}
+    del sent[:]
+    generation = show.generation
+    show.next()
+    show.stop()
+    assert sent[0][2] == generation + 1 and not show.schedule
+
+
+def test_slide_buffer(tmp_path):
+    """Unit test for buffering slides until their presentation time"""
+    slides = SlideBuffer(ImageCache(str(tmp_path), 1024))
+    now = time.time()
+    old, new = b'old slide', b'new slide'
+    assert slides.announce('1:%f:%f:%s' % (now, now - 1, digest(old))) == \
+        digest(old)
+    assert slides.announce('1:%f:%f:%s' % (now, now, digest(old))) is None
+    assert slides.announce('1:%f:%f:%s' % (now, now + 60, digest(new))) == \
+        digest(new)
+    assert slides.receive(digest(old).encode() + b':' + old)
+    assert slides.due() == old and slides.due() is None
+    assert not slides.receive(digest(new).encode() + b':')
+    assert slides.announce('2:%f:%f:%s' % (now, now - 1, digest(old))) is None
+    assert slides.announce('1:%f:%f:%s' % (now, now - 1, digest(old))) is None
+    assert slides.due() == old and slides.due() is None
+
+
+def test_thumbnails(tmp_path):
+    """Unit test for batch thumbnail generation and caching"""
+    images = tmp_path / 'images'
+    images.mkdir()
+    for i in range(3):
+        crypto_functions.Image.new('RGB', (64 + i, 32)).save(
+            images / ('%d.png' % i))
+    (images / 'notes.txt').write_text(random_string())
+    service = ThumbnailService(str(tmp_path / 'cache'), workers=1)
+    thumbnails = service.folder(str(images), (16, 16))
+    service.close()
+    assert sorted(thumbnails) == [str(images / ('%d.png' % i))
+                                  for i in range(3)]
+    assert len(list((tmp_path / 'cache').iterdir())) == 3
+    cached = ThumbnailService(str(tmp_path / 'cache'))
+    assert cached.folder(str(images), (16, 16)) == thumbnails
+    assert cached.pool is None
+    pages = list(cached.pages(str(images), (16, 16), limit=2))
+    assert [len(page) for page in pages] == [2, 1]
+    assert unpack_thumbnails(pack_thumbnails(pages[0]).encode()) == pages[0]
+    assert unpack_thumbnails(b'{"a": 1}') is None
+    assert thumbnails[str(images / '0.png')].startswith(b'\xff\xd8')
+    files = sorted((tmp_path / 'cache').iterdir())
+    os.utime(files[0], ns=(0, 0))
+    total = sum(file.stat().st_size for file in files)
+    assert ThumbnailService(str(tmp_path / 'cache'), limit=total - 1).prune() \
+        == 1
+    assert sorted((tmp_path / 'cache').iterdir()) == files[1:]
+
+
+def test_media_index(tmp_path):
+    """Unit test for sampling named media pools"""
+    for name in ('boobs', 'butts'):
+        (tmp_path / name).mkdir()
+        crypto_functions.Image.new('RGB', (8, 8)).save(
+            tmp_path / name / ('%s.png' % name))
+    options = {}
+    ops = SimpleNamespace(ops=True, options={'BOOBS_FOLDER': 'missing'})
+    server = SimpleNamespace(opt_get=options.get, clients=[ops])
+    index = MediaIndex(server)
+    person = SimpleNamespace(ops=False, options={
+        'BOOBS_FOLDER': str(tmp_path / 'boobs')})
+    assert index.sample('Boobs', person) == \
+        str(tmp_path / 'boobs' / 'boobs.png')
+    assert index.sample('boobs') is None
+    options['pool-boobs'] = str(tmp_path / 'butts')
+    assert index.sample('boobs', person) == \
+        str(tmp_path / 'butts' / 'butts.png')
+
+
+def test_listing_request():
+    """Unit test for decoding folder listing requests and pages"""
+    assert read_listing_request(b'{"path": "/", "ext": ["jpg"], '
+                                b'"cursor": [true, "a", "A"]}') == \
+        {'path': '/', 'ext': ['jpg'], 'cursor': [True, 'a', 'A']}
+    for msg in (b'\x80\x04N.', b'[]', b'{"path": 1}',
+                b'{"path": "/", "limit": 0}', b'{"path": "/", "cursor": [1]}'):
+        assert read_listing_request(msg) is None
+    page = {'path': '/', 'folders': ['a'], 'files': [], 'cursor': None,
+            'total': 1}
+    assert read_listing_page(json.dumps(page).encode()) == page
+    for bad in ({'files': [1]}, {'cursor': [1]}, {'total': None}):
+        assert read_listing_page(json.dumps({**page, **bad}).encode()) is None
+    assert read_listing_page(b'\x80\x04N.') is None
+
+
+def test_catalog(tmp_path):
+    """Unit test for the script catalog"""
+    root, db = tmp_path / 'Scripts', str(tmp_path / 'test.db')
+    (root / 'Start').mkdir(parents=True)
+    (root / 'Start' / 'hi.md').write_text('@Info Says hi\n"Hi"\nend()\n')
+    (root / 'Start' / 'old.txt').write_text('Hi\n')
+    catalog = Catalog(str(root), db)
+    assert [(entry.category, entry.info, entry.functions)
+            for entry in catalog.scripts()] == [('Start', 'Says hi', ('end',))]
+    (root / 'Module').mkdir()
+    (root / 'Module' / 'edge.md').write_text('@Info Edge\n# Go\nedge()\n')
+    os.remove(root / 'Start' / 'hi.md')
+    catalog = Catalog(str(root), db)
+    assert catalog.categories() == ['Module']
+    assert catalog.pick('module').anchors == ('Go',)
+    assert catalog.scripts(function='end') == []
+
+
+def test_convert():
+    """Unit test for converting legacy scripts"""
+    legacy = ['(Top)\n', 'Nice tits #Grin @ShowBoobsImage\n',
+              '@DifferentAnswer Huh?\n', '\n', '[yes] Good @Goto(Top)\n',
+              '@StopStroking now\n']
+    assert list(convert(legacy)) == [
+        '# Top\n', '"Nice _boobs_ _*grins*_"\n', 'showBoobsImage()\n',
+        '[yes]\n', '"Good"\n', 'goto(Top)\n', 'stopStroking()\n']
+
+
+def test_migrate(db, tmp_path):
+    """Unit test for upgrading the database schema"""
+    con = sqlite3.connect(db)
+    options = con.execute('SELECT * FROM options').fetchall()
+    con.execute("INSERT INTO options VALUES ('port', '0')")
+    con.commit()
+    assert migrate(db) == len(MIGRATIONS) == migrate(db)
+    assert con.execute('SELECT * FROM options').fetchall() == options
+    try:
+        con.execute("INSERT INTO options VALUES ('port', '0')")
+        assert False
+    except sqlite3.IntegrityError:
+        pass
+    con.execute("INSERT INTO vocab(word) VALUES ('member')")
+    con.execute("INSERT INTO synonyms VALUES ((SELECT SynID FROM vocab \
+                WHERE word = 'member'), 1)")
+    con.commit()
+    con.close()
+    vocab = Vocabulary(db)
+    assert 'member' in vocab.synonyms('cock') and \
+        vocab.synonyms('cock') == vocab.synonyms('dick')
+    assert migrate(str(tmp_path / 'new.db')) == len(MIGRATIONS)
+
+
+def test_compile_line():
+    """Unit test for compiling script lines into instructions"""
+    assert compile_line('"Hello (wink)"  \n') == (SAY, ('"Hello (wink)"',))
+    assert compile_line('chance(50, goto(Really Happy))') == \
+        (CALL, 'chance', (('50',), ('goto(Really Happy)',)))
+    assert compile_line('getAnswer()\n') == (CALL, 'getanswer', ((),))
+    assert compile_line('# Really Happy  \n') == (ANCHOR, 'Really Happy')
+    assert compile_line('[too, as,also] "Aww"\n') == \
+        (ANSWER, ('too', 'as', 'also'), ('"Aww"',))
+    assert compile_line('[no]  \n') == (ANSWER, ('no',), None)
+    assert tokenize('"_Hello_, var(chat_name) randint(1, 6)"') == \
+        ('"', (VOCAB, 'Hello'), ', ', (VAR, 'chat_name'), ' ',
+         (RANDINT, 1, 6), '"')
+
+
+def test_link():
+    """Unit test for resolving anchors and answer blocks"""
+    program = compile_script([
+        '"Yes or no?"', 'getAnswer()', '[yes] "Good"', 'goto(Done)',
+        '[no]', 'loopAnswer()', '# Done', '"Bye"', '# done', '[maybe]'])
+    anchors, blocks, loops = link(program)
+    assert anchors == {'done': 6}
+    assert blocks[1] == ((('yes',), 2), (('no',), 4))
+    assert blocks[6] == () and blocks[8] == ((('maybe',), 9),)
+    assert loops == {5: 1}
+
+
+def test_load_script(tmp_path):
+    """Unit test for the compiled script cache"""
+    script, cache = tmp_path / 'script.md', tmp_path / 'cache'
+    script.write_text('@Info test\n"Hi"\ngetAnswer()\n[yes] "Good"\n')
+    compiled = load_script(str(script), str(cache))
+    assert compiled[1] == [(SAY, ('"Hi"',)), (CALL, 'getanswer', ((),)),
+                           (ANSWER, ('yes',), ('"Good"',))]
+    assert len(os.listdir(cache)) == 1
+    assert load_script(str(script), str(cache)) == compiled
+    script.write_text('"Bye"\n')
+    assert load_script(str(script), str(cache))[1] == [(SAY, ('"Bye"',))]
+    assert len(os.listdir(cache)) == 2
+
+
+def test_shared_program(tmp_path):
+    """Unit test for sharing compiled scripts between sessions"""
+    script = tmp_path / 'script.md'
+    script.write_text('# Start\n"Hi"\ngoto(Start)\n')
+    first, second = Parser(str(script)), Parser(str(script))
+    assert first.program is second.program is load_program(str(script))
+    assert not hasattr(first, '__dict__')
+    next(first.run())
+    assert (first.index, second.index) == (1, -1)
+    os.utime(script, ns=(0, 0))
+    assert load_program(str(script)) is not first.program
+
+
+def test_run(tmp_path):
+    """Unit test for running a script as a coroutine"""
+    script = tmp_path / 'script.md'
+    script.write_text('"Ready?"\ngetAnswer(5, Well?)\n[yes] "Good"\n'
+                      'goto(End)\n[no] "Bad"\n# End\nshowImage(boobs)\n')
+    run = Parser(str(script)).run()
+    assert next(run) == Say('"Ready?"')
+    assert isinstance(next(run), WaitTime)
+    assert next(run) == WaitAnswer(5.0)
+    assert run.send(None) == Say('"Well?"')
+    assert next(run) == WaitAnswer(5.0)
+    assert run.send('maybe') == Say(MEANINGLESS)
+    assert next(run) == WaitAnswer(5.0)
+    assert run.send('Yes.') == Say('"Good"')
+    assert isinstance(next(run), WaitTime)
+    assert next(run) == ShowMedia('boobs')
+    try:
+        run.send('boobs.jpg')
+        assert False
+    except StopIteration:
+        pass
+
+
+def test_reload(tmp_path):
+    """Unit test for switching a running script to an edited version"""
+    script = tmp_path / 'script.md'
+    script.write_text('"One"\n# Two\n"Two"\n"Three"\n')
+    parser = Parser(str(script))
+    run = parser.run()
+    assert next(run) == Say('"One"')
+    script.write_text('"Uno"\n# Two\n"Two"\n"Three"\n')
+    os.utime(script, ns=(0, 0))
+    load_program(str(script))
+    assert not parser.reload()
+    next(run)
+    assert next(run) == Say('"Two"')
+    script.write_text('"Uno"\n"Dos"\n# Two\n"Two"\n"Tres"\n')
+    os.utime(script, ns=(1, 1))
+    load_program(str(script))
+    assert parser.reload() and parser.index == 3
+    next(run)
+    assert next(run) == Say('"Tres"')
+
+
+def test_profiler(tmp_path):
+    """Unit test for the script profiler"""
+    script = tmp_path / 'script.md'
+    script.write_text('"Ready?"\ngetAnswer()\n[yes] "Good"\nend()\n'
+                      '[no] "Bad"\n')
+    profile = Profile()
+    for _ in range(5):
+        simulate(str(script), profile)
+    hits = [profile.lines.get((str(script), i), [0])[0] for i in range(5)]
+    assert hits[:2] == [5, 5] and hits[2] + hits[4] == 5
+    assert profile.functions['getanswer'][0] == 5
+    assert not profile.errors
+    script.write_text('chance(100, goto(Happy))\n"Sad"\nend()\n# Happy\n'
+                      '"Happy"\n')
+    profile = Profile()
+    for _ in range(5):
+        simulate(str(script), profile)
+    hits = [profile.lines.get((str(script), i), [0])[0] for i in range(5)]
+    assert hits == [5, 0, 0, 0, 5]
+    assert profile.functions['chance'][0] == 5
+    assert 'goto' not in profile.functions
+
+
+def test_vocabulary(db):
+    """Unit test for the in-memory synonym graph"""
+    vocab = Vocabulary(db)
+    assert set(vocab.synonyms('COCK')) == {'cock', 'prick', 'dick'}
+    assert vocab.synonym('cock') in ('cock', 'prick', 'dick')
+    assert vocab.synonyms('unknown') == ('unknown',)
+    con = sqlite3.connect(db)
+    con.execute("INSERT INTO vocab(word) VALUES ('member')")
+    con.execute("INSERT INTO synonyms VALUES ((SELECT SynID FROM vocab \
+                WHERE word = 'member'), 1)")
+    con.commit()
+    con.close()
+    vocab.checked = 0
+    assert set(vocab.synonyms('dick')) == {'cock', 'prick', 'dick', 'member'}
+    migrate(db)
+    vocab.checked = 0
+    version = vocab.version()
+    chat = ChatLog(db, interval=3600)
+    chat.append('line')
+    chat.close()
+    vocab.checked = 0
+    assert vocab.version() == version
+    con = sqlite3.connect(db)
+    with con:
+        con.execute("DELETE FROM synonyms WHERE SynID = 1 AND ParentSynID = "
+                    "(SELECT SynID FROM vocab WHERE word = 'member')")
+    con.close()
+    vocab.checked = 0
+    assert vocab.version() != version
+
+
+def test_answer_index(db):
+    """Unit test for matching answers through the answer index"""
+    vocab = Vocabulary(db)
+    blocks = {0: ((('yes', 'am happy'), 2), (('no', 'not happy'), 4)),
+              1: ((('dick',), 5),)}
+    index = AnswerIndex(blocks, vocab)
+    assert index.match(0, 'Yes!', vocab) == 2
+    assert index.match(0, "Well, I'm not HAPPY...", vocab) == 4
+    assert index.match(0, 'I am happy, not sad', vocab) == 2
+    assert index.match(0, 'maybe', vocab) is None
+    assert index.match(0, 'Uh huh.', vocab) == 2
+    assert index.match(0, 'nope, no way', vocab) == 4
+    assert index.match(1, 'my cock', vocab) == 5
+    assert index.match(3, 'yes', vocab) is None
+
+
+def test_import_groups(db):
+    """Unit test for bulk importing vocabulary"""
+    migrate(db)
+    con = sqlite3.connect(db)
+    with con:
+        assert import_groups(con, [['member', 'dick', 'member', ''],
+                                   ['shaft', 'member']]) == (2, 2)
+    with con:
+        assert import_groups(con, [['cock', 'prick'], ['shaft', 'member']]) \
+            == (0, 0)
+    con.close()
+    assert set(Vocabulary(db).synonyms('shaft')) == \
+        {'cock', 'prick', 'dick', 'member', 'shaft'}
+    assert migrate(db) == len(MIGRATIONS)
+
+
+def test_state_store(db, tmp_path):
+    """Unit test for the write-behind per-user state store"""
+    migrate(db)
+    state = StateStore(db, interval=3600)
+    state.set('alice', 'var:chat_name', 'Alice')
+    state.set('bob', 'flag:Done', True)
+    assert state.flush('alice') == 1
+    state.set('alice', 'var:chat_name', 'Alice')
+    assert state.flush() == 1 and state.flush() == 0
+    script = tmp_path / 'script.md'
+    script.write_text('getFlag(Done)\n"Hi var(chat_name)"\nsetFlag(Done)\n'
+                      'end()\n# Done\n"Back, var(chat_name)"\n')
+    run = Parser(str(script), user='alice', state=state).run()
+    assert next(run) == Say('"Hi Alice"')
+    assert all(isinstance(request, WaitTime) for request in run)
+    state.unload('alice')
+    state.close()
+    state = StateStore(db, interval=3600)
+    run = Parser(str(script), user='alice', state=state).run()
+    assert next(run) == Say('"Back, Alice"')
+    state.close()
+
+
+def test_chat_log(db):
+    """Unit test for the chat history and its paged replay"""
+    migrate(db)
+    chat = ChatLog(db, size=4, interval=3600)
+    for number in range(1, 11):
+        assert chat.append('line %d' % number) == number
+    assert unpack(pack(chat.recent(3))) == chat.recent(3)
+    assert unpack(zlib.compress(b'[[1, 0, 2]]')) is None
+    assert [line[2] for line in chat.page(9, 2)] == ['line 7', 'line 8']
+    assert [line[0] for line in chat.page(7, 3)] == [4, 5, 6]
+    assert chat.page(1) == []
+    chat.append('line 11')
+    chat.close()
+    chat = ChatLog(db, size=4, interval=3600)
+    assert [line[0] for line in chat.recent()] == [8, 9, 10, 11]
+    assert chat.append('line 12') == 12
+    chat.close()
+
+
 if __name__ == "__main__":
     test_package()
     test_sign_and_verify()
     test_bytes()
+    test_playlist()
+    test_compile_line()
+    test_link()
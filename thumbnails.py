@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""Background thumbnail generation and caching"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, \
+    wait
+from io import BytesIO
+from threading import Lock
+from typing import Iterator
+
+from PIL import Image, ImageOps
+
+THUMB_SIZE = (400, 400)
+QUALITY = 80
+PAGE = 16
+THUMB_FOLDER = os.path.expanduser('~/.cache/teaseai/thumbnails')
+MEMORY = 4096
+DISK = 256 * 1024 * 1024
+PRUNE = 256
+EXTENSIONS = ('jpg', 'jpeg', 'gif', 'png', 'bmp')
+
+
+def make_thumbnail(path: str, size: tuple[int, int]) -> bytes:
+    """
+    Decodes an image, shrinks it and pads it to the given size.  Runs in a
+    worker process.
+
+    :param path: /path/to/image
+    :type path: str
+    :param size: The size of the thumbnail. (width, height)
+    :type size: tuple[int, int]
+    :return: The thumbnail as JPEG.
+    :rtype: bytes
+    """
+    with Image.open(path) as img:
+        img.draft('RGB', size)
+        img = ImageOps.pad(img.convert('RGB'), size)
+    with BytesIO() as bio:
+        img.save(bio, format='JPEG', quality=QUALITY)
+        return bio.getvalue()
+
+
+def pack_thumbnails(thumbnails: dict[str, bytes]) -> str:
+    """
+    Packs thumbnails into the body of a THB frame.
+
+    :param thumbnails: Thumbnails keyed by the full path of each image.
+    :type thumbnails: dict[str, bytes]
+    :return: The frame body, JSON with the images in base64.
+    :rtype: str
+    """
+    return json.dumps({image: base64.b64encode(data).decode()
+                       for image, data in thumbnails.items()})
+
+
+def unpack_thumbnails(msg: bytes) -> dict[str, bytes] | None:
+    """
+    Unpacks the body of a THB frame.
+
+    :param msg: The frame body.
+    :type msg: bytes
+    :return: Thumbnails keyed by the full path of each image, or None if\
+        the frame is malformed.
+    :rtype: dict[str, bytes] | None
+    """
+    try:
+        page = json.loads(msg.decode())
+        if not isinstance(page, dict) or \
+                not all(isinstance(data, str) for data in page.values()):
+            return None
+        return {image: base64.b64decode(data, validate=True)
+                for image, data in page.items()}
+    except ValueError:
+        return None
+
+
+class ThumbnailService(object):
+    """
+    Generates thumbnails in a process pool and caches them in memory and on
+    disk, keyed by path, modification time and size so edited images are
+    regenerated.  The disk cache is kept under a size limit by deleting the
+    least recently used thumbnails, which also clears out those of edited
+    and deleted images.
+    """
+
+    def __init__(self, folder: str = THUMB_FOLDER,
+                 workers: int | None = None, limit: int = DISK) -> None:
+        """
+        Initializes the thumbnail service.  The process pool and the cache
+        folder are created on first use.
+
+        Public methods:
+        - get(): Get a future for the thumbnail of one image.
+        - folder(): Get the thumbnails of every image in a folder.
+        - pages(): Get them a page at a time as they are generated.
+        - prune(): Shrink the disk cache to its size limit.
+        - close(): Shut the worker processes down.
+
+        :param folder: /path/to/folder to keep generated thumbnails in.
+        :type folder: str
+        :param workers: Number of worker processes, defaults to the number\
+            of CPUs.
+        :type workers: int | None
+        :param limit: Size limit of the disk cache in bytes.
+        :type limit: int
+        """
+        self.cache_folder = folder
+        self.workers = workers
+        self.limit = limit
+        self.pool: ProcessPoolExecutor | None = None
+        self.memory: OrderedDict[str, bytes] = OrderedDict()
+        self.pending: dict[str, Future] = {}
+        self.stored = 0
+        self.lock = Lock()
+
+    def _key(self, path: str, size: tuple[int, int]) -> str | None:
+        """
+        Returns the cache key of an image's thumbnail or None if the image is
+        gone.
+        """
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        name = '%s:%d:%dx%d' % (path, mtime, *size)
+        return hashlib.sha1(name.encode()).hexdigest()
+
+    def _remember(self, key: str, data: bytes) -> None:
+        """Keeps a thumbnail in the in-memory cache."""
+        with self.lock:
+            self.memory[key] = data
+            self.memory.move_to_end(key)
+            while len(self.memory) > MEMORY:
+                self.memory.popitem(last=False)
+
+    def _store(self, key: str, done: Future, future: Future) -> None:
+        """
+        Writes a freshly generated thumbnail to both caches, then resolves
+        the future handed out to callers.
+        """
+        if done.cancelled():
+            with self.lock:
+                self.pending.pop(key, None)
+            future.cancel()
+            return
+        if done.exception() is None:
+            self._remember(key, done.result())
+            with self.lock:
+                prune = self.stored % PRUNE == 0
+                self.stored += 1
+            try:
+                if prune:
+                    os.makedirs(self.cache_folder, exist_ok=True)
+                    self.prune()
+                with open(os.path.join(self.cache_folder, key), 'wb') as file:
+                    file.write(done.result())
+            except OSError:
+                pass
+        with self.lock:
+            self.pending.pop(key, None)
+        if done.exception() is None:
+            future.set_result(done.result())
+        else:
+            future.set_exception(done.exception())
+
+    def get(self, path: str,
+            size: tuple[int, int] = THUMB_SIZE) -> Future:
+        """
+        Returns a future for the thumbnail of an image.  Cached thumbnails
+        come back as completed futures, others are generated in the pool.
+
+        :param path: /path/to/image
+        :type path: str
+        :param size: The size of the thumbnail. (width, height)
+        :type size: tuple[int, int]
+        :return: A future resolving to the thumbnail as JPEG.
+        :rtype: :class:`Future`
+        """
+        future: Future = Future()
+        key = self._key(path, size)
+        if key is None:
+            future.set_exception(FileNotFoundError(path))
+            return future
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                future.set_result(self.memory[key])
+                return future
+            if key in self.pending:
+                return self.pending[key]
+        try:
+            cached = os.path.join(self.cache_folder, key)
+            with open(cached, 'rb') as file:
+                data = file.read()
+            os.utime(cached)
+            self._remember(key, data)
+            future.set_result(data)
+            return future
+        except OSError:
+            pass
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(self.workers)
+            work = self.pool.submit(make_thumbnail, path, size)
+            self.pending[key] = future
+        work.add_done_callback(lambda done: self._store(key, done, future))
+        return future
+
+    def folder(self, path: str,
+               size: tuple[int, int] = THUMB_SIZE) -> dict[str, bytes]:
+        """
+        Returns the thumbnails of every image in a folder, generating the
+        missing ones in parallel.
+
+        :param path: /path/to/folder
+        :type path: str
+        :param size: The size of the thumbnails. (width, height)
+        :type size: tuple[int, int]
+        :return: Thumbnails as JPEG keyed by the full path of each image.
+        :rtype: dict[str, bytes]
+        """
+        thumbnails = {}
+        for page in self.pages(path, size):
+            thumbnails.update(page)
+        return thumbnails
+
+    def pages(self, path: str, size: tuple[int, int] = THUMB_SIZE,
+              limit: int = PAGE) -> Iterator[dict[str, bytes]]:
+        """
+        Yields the thumbnails of every image in a folder as they become
+        ready, cached ones first, at most `limit` at a time.
+
+        :param path: /path/to/folder
+        :type path: str
+        :param size: The size of the thumbnails. (width, height)
+        :type size: tuple[int, int]
+        :param limit: Maximum number of thumbnails per page.
+        :type limit: int
+        :return: Pages of thumbnails as JPEG keyed by the full path of each\
+            image.
+        :rtype: Iterator[dict[str, bytes]]
+        """
+        images = {}
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if not entry.name.startswith('.') and \
+                            entry.name.lower().endswith(EXTENSIONS) and \
+                            entry.is_file():
+                        images[self.get(entry.path, size)] = entry.path
+        except OSError:
+            pass
+        waiting = set(images)
+        while waiting:
+            done, waiting = wait(waiting, return_when=FIRST_COMPLETED)
+            page = {}
+            for future in done:
+                if future.cancelled() or future.exception() is not None:
+                    continue
+                page[images[future]] = future.result()
+                if len(page) == limit:
+                    yield page
+                    page = {}
+            if page:
+                yield page
+
+    def prune(self) -> int:
+        """
+        Deletes the least recently used thumbnails from the disk cache until
+        it fits its size limit.  Runs every PRUNE thumbnails generated.
+
+        :return: The number of thumbnails deleted.
+        :rtype: int
+        """
+        try:
+            with os.scandir(self.cache_folder) as entries:
+                files = [(entry.stat().st_mtime_ns, entry.stat().st_size,
+                          entry.path) for entry in entries if entry.is_file()]
+        except OSError:
+            return 0
+        total = sum(size for _, size, _ in files)
+        deleted = 0
+        for _, size, path in sorted(files):
+            if total <= self.limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            deleted += 1
+        return deleted
+
+    def close(self) -> None:
+        """Shut the worker processes down.  They restart on next use."""
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+_shared: ThumbnailService | None = None
+_shared_lock = Lock()
+
+
+def get_thumbnails() -> ThumbnailService:
+    """
+    Returns the thumbnail service shared across the process, creating it on
+    first use.
+
+    :return: The shared thumbnail service.
+    :rtype: :class:`ThumbnailService`
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ThumbnailService()
+        return _shared
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Bulk import of vocabulary into the TeaseAI database"""
+from __future__ import annotations
+
+import argparse
+import csv
+import os
+import sqlite3
+import time
+from typing import Iterable, Iterator
+
+from migrations import DB, migrate
+from vocabulary import rebuild_clusters
+
+
+def read_folder(folder: str) -> Iterator[list[str]]:
+    """
+    Reads a legacy TeaseAI vocabulary folder, where every .txt file holds
+    one group of synonyms, one per line.
+
+    :param folder: /path/to/Vocabulary
+    :type folder: str
+    :return: The groups of synonyms.
+    :rtype: Iterator[list[str]]
+    """
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if name.lower().endswith('.txt'):
+                with open(os.path.join(root, name), 'r',
+                          errors='replace') as file:
+                    yield [line.strip() for line in file]
+
+
+def read_csv(path: str) -> Iterator[list[str]]:
+    """
+    Reads a CSV file where every row is one group of synonyms.
+
+    :param path: /path/to/file.csv
+    :type path: str
+    :return: The groups of synonyms.
+    :rtype: Iterator[list[str]]
+    """
+    with open(path, 'r', newline='') as file:
+        yield from csv.reader(file)
+
+
+def import_groups(con: sqlite3.Connection,
+                  groups: Iterable[list[str]]) -> tuple[int, int]:
+    """
+    Adds groups of synonyms to the vocabulary in the current transaction.
+    Words and pairs already in the database are skipped.  Each group is
+    linked as a star around its first word, which is enough for the words
+    to share a cluster.  The cluster triggers are suspended while the rows
+    go in and the clusters are rebuilt once at the end, as merging clusters
+    row by row is quadratic for large imports.  The vocabulary version is
+    bumped once for the whole import.
+
+    :param con: Connection to the database, committed by the caller.
+    :type con: :class:`sqlite3.Connection`
+    :param groups: The groups of synonyms.
+    :type groups: Iterable[list[str]]
+    :return: The number of words and of synonym pairs added.
+    :rtype: tuple[int, int]
+    """
+    groups = [list(dict.fromkeys(word.strip() for word in group
+                                 if word.strip()))
+              for group in groups]
+    words = {word for group in groups for word in group}
+    words.difference_update(row[0] for row in
+                            con.execute('SELECT word FROM vocab'))
+    triggers = con.execute("SELECT name, sql FROM sqlite_master WHERE "
+                           "type = 'trigger' AND tbl_name IN "
+                           "('vocab', 'synonyms')").fetchall()
+    for name, _ in triggers:
+        con.execute('DROP TRIGGER "%s"' % name)
+    con.executemany('INSERT INTO vocab(word) VALUES (?)',
+                    ((word,) for word in sorted(words)))
+    ids = dict(con.execute('SELECT word, SynID FROM vocab'))
+    known = {frozenset(pair) for pair in
+             con.execute('SELECT ParentSynID, SynID FROM synonyms')}
+    pairs = set()
+    for group in groups:
+        first = ids[group[0]] if group else None
+        for word in group[1:]:
+            pair = frozenset((first, ids[word]))
+            if len(pair) == 2 and pair not in known:
+                known.add(pair)
+                pairs.add((first, ids[word]))
+    con.executemany('INSERT INTO synonyms(ParentSynID, SynID) VALUES (?, ?)',
+                    sorted(pairs))
+    rebuild_clusters(con)
+    for _, sql in triggers:
+        con.execute(sql)
+    con.execute('UPDATE vocab_version SET version = version + 1')
+    return len(words), len(pairs)
+
+
+def main(argv: list[str] | None = None) -> None:
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(
+        description='Import vocabulary folders or CSV files.')
+    parser.add_argument('sources', nargs='+',
+                        help='legacy vocabulary folders or CSV files')
+    parser.add_argument('--db', default=DB, help='database to import into')
+    args = parser.parse_args(argv)
+    migrate(args.db)
+    start = time.perf_counter()
+    groups: list[list[str]] = []
+    for source in args.sources:
+        groups.extend(read_folder(source) if os.path.isdir(source)
+                      else read_csv(source))
+    con = sqlite3.connect(args.db)
+    try:
+        with con:
+            con.execute('BEGIN')
+            words, pairs = import_groups(con, groups)
+        con.execute('ANALYZE')
+    finally:
+        con.close()
+    seconds = time.perf_counter() - start
+    print('Imported %d words and %d synonym pairs from %d groups in %.2f s '
+          '(%.0f rows/s).' % (words, pairs, len(groups), seconds,
+                              (words + pairs) / max(seconds, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
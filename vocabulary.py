@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""In-memory vocabulary shared by every script parser"""
+from __future__ import annotations
+
+import os
+import random
+import sqlite3
+import time
+from threading import Lock
+from typing import Iterable
+
+DB = 'teaseai.db'
+CHECK = 1.0
+
+_shared: dict[str, Vocabulary] = {}
+_shared_lock = Lock()
+
+
+def find_clusters(syn_ids: Iterable[int],
+                  edges: Iterable[tuple[int, int]]) -> dict[int, int]:
+    """
+    Groups words into clusters of synonyms with union-find.  Each cluster
+    is identified by the smallest SynID in it.
+
+    :param syn_ids: The SynID of every word.
+    :type syn_ids: Iterable[int]
+    :param edges: (ParentSynID, SynID) pairs of synonyms.
+    :type edges: Iterable[tuple[int, int]]
+    :return: The cluster id of every word, keyed by SynID.
+    :rtype: dict[int, int]
+    """
+    parents = {syn_id: syn_id for syn_id in syn_ids}
+
+    def find(syn_id: int) -> int:
+        while parents[syn_id] != syn_id:
+            parents[syn_id] = parents[parents[syn_id]]
+            syn_id = parents[syn_id]
+        return syn_id
+
+    for parent, child in edges:
+        if parent in parents and child in parents:
+            parent, child = find(parent), find(child)
+            if parent != child:
+                parents[max(parent, child)] = min(parent, child)
+    return {syn_id: find(syn_id) for syn_id in parents}
+
+
+def rebuild_clusters(con: sqlite3.Connection) -> None:
+    """
+    Recomputes the clusters table from the vocab and synonyms tables.
+    Inserts keep the table up to date through triggers, this is only needed
+    after synonyms are deleted.
+
+    :param con: Connection to the database, committed by the caller.
+    :type con: :class:`sqlite3.Connection`
+    """
+    clusters = find_clusters(
+        (row[0] for row in con.execute('SELECT SynID FROM vocab')),
+        con.execute('SELECT ParentSynID, SynID FROM synonyms').fetchall())
+    con.execute('DELETE FROM clusters')
+    con.executemany('INSERT INTO clusters VALUES (?, ?)', clusters.items())
+
+
+class Vocabulary(object):
+    """
+    The synonym graph from the database loaded into memory as connected
+    components, so drawing a random synonym is a dictionary lookup and a
+    random choice.  The graph is reloaded when the vocab or synonyms tables
+    change.
+    """
+
+    def __init__(self, db: str = DB) -> None:
+        """
+        Loads the vocabulary.
+
+        Public methods:
+        - synonym(): Draw a random synonym for a word.
+        - synonyms(): Get every synonym of a word.
+        - canonical(): Get the representative of a word's synonyms.
+        - version(): Get a stamp that changes when the graph reloads.
+
+        :param db: /path/to/database
+        :type db: str
+        """
+        self.db = db
+        self.words: dict[str, tuple[str, ...]] = {}
+        self.stamp: tuple[int, ...] | None = None
+        self.checked = 0.0
+        self.lock = Lock()
+        self._refresh()
+
+    def _stamp(self) -> tuple[int, ...] | None:
+        """
+        Returns the counter the vocabulary triggers bump, or the row counts
+        of the vocab and synonyms tables if the database predates it.  The
+        stamp of the database file would change with every write to the
+        chat log or user state as well.
+        """
+        if not os.path.exists(self.db):
+            return None
+        con = sqlite3.connect(self.db)
+        try:
+            try:
+                return con.execute('SELECT version FROM vocab_version'
+                                   ).fetchone()
+            except sqlite3.OperationalError:
+                return con.execute('SELECT (SELECT count(*) FROM vocab), '
+                                   '(SELECT count(*) FROM synonyms)'
+                                   ).fetchone()
+        except sqlite3.Error:
+            return None
+        finally:
+            con.close()
+
+    def _refresh(self) -> None:
+        """Reloads the graph if the database changed since the last load."""
+        self.checked = time.monotonic()
+        stamp = self._stamp()
+        if stamp is None or stamp == self.stamp:
+            return
+        with self.lock:
+            if stamp != self.stamp:
+                self.words = self._load()
+                self.stamp = stamp
+
+    def _load(self) -> dict[str, tuple[str, ...]]:
+        """
+        Reads the vocabulary grouped into clusters of synonyms from the
+        clusters table, or clusters the synonyms table itself if the
+        database predates it.
+
+        :return: The cluster of every word, keyed by lowercase word.
+        :rtype: dict[str, tuple[str, ...]]
+        """
+        con = sqlite3.connect(self.db)
+        try:
+            try:
+                rows = con.execute('SELECT word, ClusterID FROM vocab '
+                                   'JOIN clusters USING (SynID) '
+                                   'ORDER BY SynID').fetchall()
+            except sqlite3.OperationalError:
+                words = dict(con.execute('SELECT SynID, word FROM vocab'))
+                clusters = find_clusters(words, con.execute(
+                    'SELECT ParentSynID, SynID FROM synonyms'))
+                rows = [(words[syn_id], cluster)
+                        for syn_id, cluster in clusters.items()]
+        finally:
+            con.close()
+        groups: dict[int, list[str]] = {}
+        for word, cluster in rows:
+            groups.setdefault(cluster, []).append(word)
+        components = {}
+        for group in groups.values():
+            component = tuple(group)
+            for word in component:
+                components[word.lower()] = component
+        return components
+
+    def synonyms(self, word: str) -> tuple[str, ...]:
+        """
+        Returns every synonym of a word, including the word itself.
+
+        :param word: The word to look up.
+        :type word: str
+        :return: The word's synonyms, or just the word if it is unknown.
+        :rtype: tuple[str, ...]
+        """
+        if time.monotonic() - self.checked > CHECK:
+            self._refresh()
+        return self.words.get(word.lower(), (word,))
+
+    def version(self) -> tuple[int, ...] | None:
+        """
+        Returns a stamp that changes whenever the vocabulary is reloaded, for
+        caches built from it.
+
+        :return: The vocabulary's change counter when loaded.
+        :rtype: tuple[int, ...] | None
+        """
+        if time.monotonic() - self.checked > CHECK:
+            self._refresh()
+        return self.stamp
+
+    def canonical(self, word: str) -> str:
+        """
+        Returns the word that stands for all synonyms of a word, so
+        synonyms compare equal.
+
+        :param word: The word to look up.
+        :type word: str
+        :return: The casefolded representative of the word's synonyms.
+        :rtype: str
+        """
+        return self.words.get(word.lower(), (word,))[0].casefold()
+
+    def synonym(self, word: str) -> str:
+        """
+        Returns a randomly selected synonym of a word.
+
+        :param word: The word to look up.
+        :type word: str
+        :return: A synonym, possibly the word itself.
+        :rtype: str
+        """
+        return random.choice(self.synonyms(word))
+
+
+def get_vocabulary(db: str = DB) -> Vocabulary:
+    """
+    Returns the vocabulary for a database, shared across the process.
+
+    :param db: /path/to/database
+    :type db: str
+    :return: The shared vocabulary.
+    :rtype: :class:`Vocabulary`
+    """
+    path = os.path.abspath(db)
+    with _shared_lock:
+        if path not in _shared:
+            _shared[path] = Vocabulary(db)
+        return _shared[path]
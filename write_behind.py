@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Base class for stores that write to the database in batches"""
+from __future__ import annotations
+
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from threading import Condition, Lock, Thread
+from typing import Any
+
+DB = 'teaseai.db'
+FLUSH = 5.0
+
+
+class WriteBehind(ABC):
+    """
+    Keeps data in memory and writes the changes to the database in one
+    transaction every FLUSH seconds from a background thread.  Subclasses
+    hold their data under `cond` and implement `_take()`, `_write()` and
+    `_restore()`, then call this constructor last.
+    """
+
+    def __init__(self, db: str | None = DB, interval: float = FLUSH) -> None:
+        """
+        Starts the flush thread.
+
+        :param db: /path/to/database, or None to keep data in memory only.
+        :type db: str | None
+        :param interval: Seconds between flushes.
+        :type interval: float
+        """
+        self.db = db
+        self.interval = interval
+        self.cond = Condition()
+        self.flush_lock = Lock()
+        self.running = db is not None
+        if self.running:
+            Thread(target=self._flusher, daemon=True).start()
+
+    @abstractmethod
+    def _take(self, *args: Any) -> list[tuple]:
+        """Removes and returns the rows to write, called under `cond`."""
+
+    @abstractmethod
+    def _write(self, con: sqlite3.Connection, rows: list[tuple]) -> None:
+        """Writes rows in the current transaction."""
+
+    @abstractmethod
+    def _restore(self, rows: list[tuple]) -> None:
+        """Puts back rows that failed to write, called under `cond`."""
+
+    def flush(self, *args: Any) -> int:
+        """
+        Writes the changes to the database in one transaction.  Flushes run
+        one at a time, so older rows never commit after newer ones.
+
+        :param args: Passed on to `_take()`.
+        :type args: Any
+        :return: The number of rows written.
+        :rtype: int
+        """
+        with self.flush_lock:
+            with self.cond:
+                rows = self._take(*args)
+            if not rows or self.db is None:
+                return 0
+            try:
+                con = sqlite3.connect(self.db)
+                try:
+                    with con:
+                        self._write(con, rows)
+                finally:
+                    con.close()
+            except sqlite3.Error:
+                with self.cond:
+                    self._restore(rows)
+                raise
+            return len(rows)
+
+    def _flusher(self) -> None:
+        """Background thread flushing the changes periodically."""
+        deadline = time.monotonic() + self.interval
+        while True:
+            with self.cond:
+                while self.running and time.monotonic() < deadline:
+                    self.cond.wait(deadline - time.monotonic())
+                if not self.running:
+                    return
+            deadline = time.monotonic() + self.interval
+            try:
+                self.flush()
+            except sqlite3.Error:
+                pass
+
+    def close(self) -> None:
+        """Flushes the changes and stops the flush thread."""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.flush()